@@ -0,0 +1,130 @@
+"""Concurrency check of the hot product inventory mode of the products
+service: many threads reserve the same hot product while the reconciler
+runs, and the product must not be oversold.
+
+Run from the project root:
+
+    python -m benchmarks.hot_inventory_oversell [--db-url URL]
+
+Uses a sqlite file by default, pass a Postgres url to check the row locking
+of a real deployment. Prints the results as JSON and exits with a non zero
+status if the stock doesn't add up.
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "products" / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from db import Base, Product, ProductStatus, ProductStockShard
+from hot_inventory import HotSkuInventory
+from inventory import reserve_stock
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url")
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    db_url = args.db_url or f"sqlite:///{tempfile.mkdtemp()}/hot_inventory.db"
+    engine = sa.create_engine(
+        db_url,
+        pool_size=args.threads + 2,
+        **({"connect_args": {"timeout": 60}} if db_url.startswith("sqlite") else {}),
+    )
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    Session = so.sessionmaker(bind=engine)
+
+    with Session() as session:
+        product = Product(
+            title="Flash sale", description="", user_id=1,
+            status=ProductStatus.ACTIVE, quantity=args.stock,
+        )
+        session.add(product)
+        session.commit()
+        product_id = product.id
+
+    hot_skus = HotSkuInventory([product_id], shards=args.shards)
+    with Session() as session:
+        hot_skus.sync(session)
+
+    booked = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def buyer():
+        failures_in_a_row = 0
+        # Keep buying till the product is sold out for a while
+        while failures_in_a_row < 20:
+            quantity = random.randint(1, 3)
+            with Session() as session:
+                remaining = reserve_stock(session, product_id, quantity, hot_skus)
+                session.commit()
+            if remaining is None:
+                failures_in_a_row += 1
+                continue
+            failures_in_a_row = 0
+            with lock:
+                booked.append(quantity)
+
+    def reconciler():
+        while not done.is_set():
+            hot_skus.reconcile_all(Session)
+            time.sleep(0.01)
+
+    reconciler_thread = threading.Thread(target=reconciler)
+    reconciler_thread.start()
+    start = time.perf_counter()
+    buyers = [threading.Thread(target=buyer) for _ in range(args.threads)]
+    for t in buyers:
+        t.start()
+    for t in buyers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    reconciler_thread.join()
+
+    hot_skus.reconcile_all(Session)
+    with Session() as session:
+        shards = session.scalars(
+            sa.select(ProductStockShard.quantity)
+            .where(ProductStockShard.product_id == product_id)
+        ).all()
+        quantity = session.scalar(
+            sa.select(Product.quantity).where(Product.id == product_id)
+        )
+
+    total_booked = sum(booked)
+    ok = (
+        total_booked <= args.stock
+        and all(q >= 0 for q in shards)
+        and sum(shards) == quantity == args.stock - total_booked
+    )
+    print(json.dumps({
+        "db": engine.dialect.name,
+        "stock": args.stock,
+        "booked": total_booked,
+        "reservations": len(booked),
+        "left": quantity,
+        "shards": shards,
+        "reservations_per_sec": round(len(booked) / elapsed, 1),
+        "ok": ok,
+    }, indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""Load test of the order placement path. Boots the users, products and
+orders services in this process, each with its own DB, and drives
+concurrent workloads through their ASGI apps:
+
+- login: POST /users/token of many users
+- catalog: GET /products/{id}, and GET /products for one in ten requests
+- orders: POST /orders with carts of several products
+- hot_sku: POST /orders of a single product with little stock. The orders
+  are booked by the outbox worker, the run waits for all of them to be
+  booked or cancelled and checks that the product is not oversold.
+
+Run from the project root:
+
+    python -m benchmarks.load_test [--requests 500] [--concurrency 8]
+        [--workloads login,catalog,orders,hot_sku] [--hot-shards 8]
+        [--users-db-url URL --products-db-url URL --orders-db-url URL]
+
+Uses sqlite files by default, pass Postgres urls to load a real DB. The
+defaults are sized for sqlite and the run takes well under a minute. The
+login of the users service queries its DB in the event loop, so with a
+concurrency above its pool (USERS_DB_POOL_SIZE + USERS_DB_MAX_OVERFLOW,
+15 by default) the logins stall on the pool timeout. Raise the pool along
+with --concurrency, eg. for 2000 requests at a concurrency of 32 against
+Postgres. The tables of the given DBs are dropped and created again.
+
+Prints the throughput and latency percentiles of every workload as JSON,
+compare the output between commits to catch regressions. Exits with a non
+zero status if the hot product is oversold.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import ModuleType
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import jwt
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+ROOT = Path(__file__).resolve().parent.parent
+PRIVATE_KEY_FILE = ROOT / "users" / "private_key.pem"
+PUBLIC_KEY_FILE = ROOT / "users" / "public_key.pem"
+PASSWORD = "password"
+
+# The package shared by the services, when it's not installed
+sys.path.insert(0, str(ROOT / "common"))
+
+
+def load_service(name: str, modules: List[str]) -> Dict[str, ModuleType]:
+    """Imports the modules of a service with only its src on the path.
+
+    The services have modules with the same names (app, config, db...), so
+    the modules of a service are removed from sys.modules once imported.
+    They keep working, the references between them are bound at import.
+    The modules of the common package are imported again for every service,
+    like they are in the process of each service.
+    """
+    src = str(ROOT / name / "src")
+    before = set(sys.modules)
+    sys.path.insert(0, src)
+    try:
+        loaded = {module: importlib.import_module(module) for module in modules}
+    finally:
+        sys.path.remove(src)
+        for module in set(sys.modules) - before:
+            if _is_from(sys.modules[module], src) or module.split(".")[0] == "ecomm_common":
+                del sys.modules[module]
+    return loaded
+
+
+def _is_from(module: ModuleType, src: str) -> bool:
+    # Namespace packages like orders' web have a __path__ but no __file__
+    paths = [getattr(module, "__file__", None) or "", *getattr(module, "__path__", [])]
+    return any(path.startswith(src) for path in paths)
+
+
+def token(user_id: int, username: str, role: str = "buyer") -> str:
+    """Token with the claims of the ones issued by the users service"""
+    return jwt.encode(
+        {
+            "iss": "user_srv",
+            "user_id": user_id,
+            "username": username,
+            "user_role": role,
+            "exp": datetime.now(timezone.utc) + timedelta(hours=1),
+        },
+        PRIVATE_KEY_FILE.read_bytes(),
+        algorithm="RS256",
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    # Nearest rank
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+async def run_workload(
+    call: Callable[[int], Awaitable[int]], requests: int, concurrency: int,
+) -> Dict:
+    """Makes `requests` calls, `concurrency` at a time. `call` returns the
+    status code of the response.
+    """
+    latencies = []
+    statuses = Counter()
+    numbers = iter(range(requests))
+
+    async def worker():
+        for i in numbers:
+            start = time.perf_counter()
+            try:
+                status = await call(i)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": {
+            name: round(percentile(latencies, p) * 1000, 2)
+            for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "statuses": dict(statuses),
+    }
+
+
+async def wait_for_bookings(Session, timeout: float) -> float:
+    """Waits till the outbox worker booked or cancelled all the orders,
+    returns the seconds it took.
+    """
+    def pending() -> int:
+        with Session() as session:
+            return session.scalar(sa.text("SELECT count(*) FROM orders WHERE status = 'PENDING'"))
+
+    start = time.perf_counter()
+    while await asyncio.to_thread(pending):
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"Orders still PENDING after {timeout}s")
+        await asyncio.sleep(0.1)
+    return time.perf_counter() - start
+
+
+def seed_users(users: Dict[str, ModuleType], n_users: int):
+    db = users["db"]
+    engine = users["app"].engine
+    db.Base.metadata.drop_all(engine)
+    db.Base.metadata.create_all(engine)
+    with so.Session(engine) as session:
+        session.add_all(
+            db.BuyerProfile(
+                shipping_address="earth",
+                user=db.User(
+                    first_name="Load",
+                    last_name="Test",
+                    username=f"user{i}",
+                    email=f"user{i}@example.com",
+                    hashed_password=users["auth"].hash_password(PASSWORD),
+                    role=db.UserRole.BUYER,
+                ),
+            )
+            for i in range(n_users)
+        )
+        session.commit()
+
+
+def seed_products(products: Dict[str, ModuleType], n_products: int, hot_stock: int):
+    db = products["db"]
+    engine = products["app"].engine
+    db.Base.metadata.drop_all(engine)
+    db.Base.metadata.create_all(engine)
+    with so.Session(engine) as session:
+        # The hot product first, its id is 1
+        session.execute(sa.insert(db.Product), [
+            {
+                "title": f"Product {i}",
+                "description": "Load test",
+                "user_id": 1,
+                "status": db.ProductStatus.ACTIVE,
+                "quantity": hot_stock if i == 1 else 1_000_000,
+            }
+            for i in range(1, n_products + 1)
+        ])
+        session.commit()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", default="login,catalog,orders,hot_sku")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--cart-size", type=int, default=5)
+    parser.add_argument("--hot-stock", type=int, default=500)
+    parser.add_argument("--hot-shards", type=int, default=0, help="0 to book the hot product without shards")
+    parser.add_argument("--settle-timeout", type=float, default=120)
+    parser.add_argument("--users-db-url")
+    parser.add_argument("--products-db-url")
+    parser.add_argument("--orders-db-url")
+    args = parser.parse_args()
+    workloads = args.workloads.split(",")
+
+    tmp = tempfile.mkdtemp()
+    db_urls = {
+        "USERS_DB_URL": args.users_db_url or f"sqlite:///{tmp}/users.db",
+        "PRODUCTS_DB_URL": args.products_db_url or f"sqlite:///{tmp}/products.db",
+        "ORDERS_DB_URL": args.orders_db_url or f"sqlite:///{tmp}/orders.db",
+    }
+    # The services read their config from the environment when imported
+    os.environ.update(db_urls)
+    os.environ["AUTH_JWT_PUBLIC_KEY_FILE"] = str(PUBLIC_KEY_FILE)
+    os.environ["AUTH_JWT_PRIVATE_KEY_FILE"] = str(PRIVATE_KEY_FILE)
+    if args.hot_shards:
+        os.environ["HOT_SKU_PRODUCT_IDS"] = "[1]"
+        os.environ["HOT_SKU_SHARDS"] = str(args.hot_shards)
+    logging.basicConfig(level=logging.WARNING)
+
+    users = load_service("users", ["app", "db", "auth"])
+    products = load_service("products", ["app", "db"])
+    orders = load_service("orders", ["web.app", "repository.models"])
+
+    seed_users(users, args.users)
+    seed_products(products, args.products, args.hot_stock)
+    orders_engine = sa.create_engine(db_urls["ORDERS_DB_URL"])
+    orders["repository.models"].Base.metadata.drop_all(orders_engine)
+    orders["repository.models"].Base.metadata.create_all(orders_engine)
+    orders_engine.dispose()
+
+    users_app = users["app"].app
+    products_app = products["app"].app
+    orders_app = orders["web.app"].app
+    tokens = [
+        {"Authorization": f"Bearer {token(i + 1, f'user{i}')}"}
+        for i in range(args.users)
+    ]
+    rnd = random.Random(42)
+    results = {}
+
+    async with AsyncExitStack() as stack:
+        # ASGITransport doesn't run the lifespans
+        for app in (users_app, products_app, orders_app):
+            await stack.enter_async_context(app.router.lifespan_context(app))
+
+        def client(app, name: str) -> httpx.AsyncClient:
+            return httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url=f"http://{name}",
+            )
+
+        users_client = await stack.enter_async_context(client(users_app, "users"))
+        products_client = await stack.enter_async_context(client(products_app, "products"))
+        orders_client = await stack.enter_async_context(client(orders_app, "orders"))
+        # The orders service books the products through the products app in
+        # this process instead of over the network
+        orders_app.state.products_client.http_client = await stack.enter_async_context(
+            client(products_app, "products")
+        )
+
+        async def login(i: int) -> int:
+            resp = await users_client.post("/users/token", data={
+                "username": f"user{i % args.users}", "password": PASSWORD,
+            })
+            return resp.status_code
+
+        async def catalog(i: int) -> int:
+            if i % 10 == 0:
+                resp = await products_client.get("/products", params={"limit": 20})
+            else:
+                resp = await products_client.get(f"/products/{rnd.randint(2, args.products)}")
+            return resp.status_code
+
+        async def place_order(i: int) -> int:
+            # The hot product is left out of the carts
+            product_ids = rnd.sample(range(2, args.products + 1), args.cart_size)
+            resp = await orders_client.post(
+                "/orders",
+                json={"items": [
+                    {"product_id": product_id, "quantity": rnd.randint(1, 3)}
+                    for product_id in product_ids
+                ]},
+                headers=tokens[i % args.users],
+            )
+            return resp.status_code
+
+        hot_order_ids = []
+
+        async def order_hot_sku(i: int) -> int:
+            resp = await orders_client.post(
+                "/orders",
+                json={"items": [{"product_id": 1, "quantity": 1}]},
+                headers=tokens[i % args.users],
+            )
+            if resp.status_code == 201:
+                hot_order_ids.append(resp.json()["id"])
+            return resp.status_code
+
+        calls = {
+            "login": login,
+            "catalog": catalog,
+            "orders": place_order,
+            "hot_sku": order_hot_sku,
+        }
+        Session = orders_app.state.Session
+        for name in workloads:
+            results[name] = await run_workload(calls[name], args.requests, args.concurrency)
+            if name in ("orders", "hot_sku"):
+                results[name]["booking_seconds"] = round(
+                    await wait_for_bookings(Session, args.settle_timeout), 3,
+                )
+
+        ok = True
+        if "hot_sku" in workloads:
+            results["hot_sku"]["oversell_check"] = check_hot_sku(
+                products, Session, hot_order_ids, args.hot_stock,
+            )
+            ok = results["hot_sku"]["oversell_check"]["ok"]
+
+    print(json.dumps({
+        "db": {name: sa.make_url(url).get_backend_name() for name, url in db_urls.items()},
+        "workloads": results,
+        "ok": ok,
+    }, indent=2))
+    return 0 if ok else 1
+
+
+def check_hot_sku(products: Dict[str, ModuleType], Session, order_ids: List[int], stock: int) -> Dict:
+    """The orders of the hot product which were booked must add up to the
+    stock taken from it, and never more than its stock.
+    """
+    app = products["app"]
+    if app.hot_skus.product_ids:
+        app.hot_skus.reconcile_all(app.Session)
+
+    with Session() as session:
+        booked = session.scalar(
+            sa.text("SELECT count(*) FROM orders WHERE status = 'CREATED' AND id IN :ids")
+            .bindparams(sa.bindparam("ids", expanding=True)),
+            {"ids": order_ids},
+        ) if order_ids else 0
+    with app.Session() as session:
+        left = session.scalar(sa.select(products["db"].Product.quantity).where(products["db"].Product.id == 1))
+
+    return {
+        "stock": stock,
+        "orders": len(order_ids),
+        "booked": booked,
+        "left": left,
+        "ok": booked <= stock and left == stock - booked,
+    }
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,86 @@
+"""Checks that the number of queries run by the orders repository doesn't grow
+with the number of orders returned, ie. there is no N+1 loading of the items.
+
+Run from the project root:
+
+    python -m benchmarks.orders_query_count
+
+Prints the query counts as JSON and exits with a non zero status on a
+regression.
+"""
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "orders" / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from orders_service.orders import OrderItem
+from repository.models import Base
+from repository.orders_repository import OrdersRepository
+
+
+class QueryCounter:
+    def __init__(self, engine: sa.Engine):
+        self.count = 0
+        sa.event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def seed(session: so.Session, n_orders: int, items_per_order: int, user_id: int = 1):
+    repo = OrdersRepository(session)
+    for i in range(n_orders):
+        repo.add(
+            [OrderItem(product_id=p, quantity=1) for p in range(items_per_order)],
+            user_id,
+        )
+    session.commit()
+
+
+def count_queries(engine: sa.Engine, counter: QueryCounter, fn) -> int:
+    with so.Session(engine) as session:
+        before = counter.count
+        fn(OrdersRepository(session))
+        return counter.count - before
+
+
+def main() -> int:
+    engine = sa.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    counter = QueryCounter(engine)
+
+    with so.Session(engine) as session:
+        seed(session, n_orders=200, items_per_order=5)
+
+    results = {
+        "list_orders": {
+            limit: count_queries(
+                engine, counter,
+                lambda repo: repo.list_orders(limit=limit, user_id=1),
+            )
+            for limit in (1, 10, 100)
+        },
+        "get_order": {
+            order_id: count_queries(
+                engine, counter,
+                lambda repo: repo.get_order(order_id, user_id=1),
+            )
+            for order_id in (1, 100)
+        },
+    }
+
+    failures = [
+        name for name, counts in results.items()
+        if len(set(counts.values())) != 1
+    ]
+    print(json.dumps({"queries": results, "failures": failures}, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
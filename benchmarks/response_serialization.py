@@ -0,0 +1,126 @@
+"""Measures the cost of serialising large order lists, the response of
+GET /orders, on the paths a handler can take:
+
+- validated_json: the handler returns a dict, FastAPI validates it against
+  the response_model and renders it with the stdlib json (JSONResponse)
+- validated_orjson: the same with ORJSONResponse as the default class
+- orjson: the handler returns an ORJSONResponse of the dict, skipping the
+  validation, as the orders service does
+
+Run from the project root:
+
+    python -m benchmarks.response_serialization [--orders 100,1000,10000] [--items 5]
+
+Prints the milliseconds per response of every path as JSON, and exits with
+a non zero status if the paths don't render the same JSON.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "orders" / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.utils import create_response_field
+
+from orders_service.orders import Order, OrderItem, OrderStatus
+from web.schemas import GetOrdersSchema
+
+RESPONSE_FIELD = create_response_field(name="response", type_=GetOrdersSchema)
+
+
+def make_orders(n_orders: int, items_per_order: int) -> List[Order]:
+    start = datetime(2024, 1, 1)
+    return [
+        Order(
+            items=[
+                OrderItem(product_id=p, quantity=1 + p % 3, id=i * items_per_order + p)
+                for p in range(items_per_order)
+            ],
+            status=OrderStatus.CREATED,
+            user_id=1,
+            id=i + 1,
+            created_at=start + timedelta(seconds=i, microseconds=i),
+            updated_at=start + timedelta(seconds=i),
+        )
+        for i in range(n_orders)
+    ]
+
+
+def content(orders: List[Order]) -> Dict:
+    """What GET /orders builds from the orders of the repository"""
+    return {"orders": [order.dict() for order in orders], "next_cursor": None}
+
+
+def validated(response_class) -> Callable[[List[Order]], bytes]:
+    def render(orders: List[Order]) -> bytes:
+        # What fastapi.routing.serialize_response does with the content
+        # returned by a handler
+        value, errors = RESPONSE_FIELD.validate(content(orders), {}, loc=("response",))
+        assert not errors, errors
+        return response_class(RESPONSE_FIELD.serialize(value, by_alias=True)).body
+    return render
+
+
+def orjson_response(orders: List[Order]) -> bytes:
+    return ORJSONResponse(content(orders)).body
+
+
+PATHS = {
+    "validated_json": validated(JSONResponse),
+    "validated_orjson": validated(ORJSONResponse),
+    "orjson": orjson_response,
+}
+
+
+def timeit(render: Callable[[List[Order]], bytes], orders: List[Order], min_seconds: float = 0.5) -> float:
+    """Milliseconds per call, the best of 3 runs of at least `min_seconds`"""
+    best = float("inf")
+    for _ in range(3):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            render(orders)
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+        best = min(best, elapsed / calls)
+    return round(best * 1000, 3)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", default="100,1000,10000")
+    parser.add_argument("--items", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for n_orders in [int(n) for n in args.orders.split(",")]:
+        orders = make_orders(n_orders, args.items)
+
+        bodies = {name: json.loads(render(orders)) for name, render in PATHS.items()}
+        if any(body != bodies["validated_json"] for body in bodies.values()):
+            failures.append(n_orders)
+
+        timings = {name: timeit(render, orders) for name, render in PATHS.items()}
+        results[n_orders] = {
+            "ms": timings,
+            "speedup": round(timings["validated_json"] / timings["orjson"], 1),
+        }
+
+    print(json.dumps(
+        {"items_per_order": args.items, "orders": results, "failures": failures},
+        indent=2,
+    ))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
+
+
+def create_engine(
+    url: str,
+    echo: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    pool_recycle: int = -1,
+) -> sa.Engine:
+    """Creates the engine of the DB of a service. There should be a single
+    engine per process so that the DB connections are pooled across requests.
+    """
+    url = sa.make_url(url)
+
+    kwargs = {}
+    # Sizing only applies to QueuePool. In memory sqlite dbs use a
+    # different pool which doesn't accept these arguments.
+    if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+        kwargs.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+        )
+
+    return sa.create_engine(
+        url,
+        echo=echo,
+        pool_pre_ping=pool_pre_ping,
+        pool_recycle=pool_recycle,
+        **kwargs,
+    )
+
+
+def pool_stats(engine: sa.Engine) -> dict:
+    pool = engine.pool
+    stats = {
+        "pool": type(pool).__name__,
+        "status": pool.status(),
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+        )
+    return stats
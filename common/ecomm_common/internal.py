@@ -0,0 +1,32 @@
+import hmac
+from typing import Annotated, Optional
+
+from fastapi import Header, HTTPException, status
+
+# Guard of the endpoints which expose the internals of a service, /internal/*
+# and /metrics. They show SQL statements, traces and the state of the pools,
+# so they are off unless the service has a token, and are then served only
+# to the callers which send it as a bearer token. Prometheus sends it with
+# the `authorization` setting of its scrape config.
+
+
+class InternalAuth:
+    """Dependency of the internal endpoints"""
+
+    def __init__(self, token: Optional[str]):
+        self.token = token
+
+    def __call__(self, authorization: Annotated[Optional[str], Header()] = None):
+        if not self.token:
+            # As if the endpoints didn't exist
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+        scheme, _, credentials = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+            credentials.encode(), self.token.encode(),
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid internal token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
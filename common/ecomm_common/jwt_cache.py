@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of the payloads of the tokens which are already verified.
+
+    Clients reuse the same bearer token for many requests and verifying its
+    signature is the most expensive part of authenticating a request. The
+    entries are keyed by the digest of the token, so the tokens themselves
+    are not kept in memory, and are valid until the `exp` of the token.
+    A `maxsize` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[Dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, token: str, verify: Callable[[str], Dict]) -> Dict:
+        """Returns the payload of the token. `verify` is called to decode and
+        verify the token when it is not in the cache, the errors raised by it
+        are propagated and nothing is cached.
+        The returned payload is shared between requests, don't modify it.
+        """
+        if self.maxsize <= 0:
+            return verify(token)
+
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.time() < entry[1]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+            self.misses += 1
+
+        payload = verify(token)
+
+        exp = payload.get("exp")
+        # Tokens without an expiry are verified every time
+        if exp is None:
+            return payload
+
+        with self._lock:
+            self._entries[key] = (payload, float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return payload
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509 import load_pem_x509_certificate
+
+
+def load_public_key(public_key_file: str):
+    """Loads the key used to verify the tokens. The file can either be a
+    x509 certificate or a PEM encoded public key.
+    """
+    public_key_text = Path(public_key_file).read_text().encode()
+    if b"BEGIN CERTIFICATE" in public_key_text:
+        return load_pem_x509_certificate(public_key_text).public_key()
+    return serialization.load_pem_public_key(public_key_text)
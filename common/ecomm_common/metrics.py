@@ -0,0 +1,285 @@
+import bisect
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
+
+# Metrics of the service in the Prometheus text exposition format, served on
+# /metrics. The values are kept in memory per process and rendered on a
+# scrape, recording a value is a dict update under a lock.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast cached read to a slow write
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# DB time of the request being served, set by MetricsMiddleware. The request
+# handlers run in worker threads with a copy of the context, the list is
+# shared so that their queries add to it.
+_request_db_time: ContextVar[List[float] | None] = ContextVar("request_db_time", default=None)
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [count per bucket, sum]. The counts are not cumulative,
+        # they are summed up on a scrape.
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _labels(names, labels + (_number(bound),)),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _labels(self.labelnames, labels), cumulative
+
+
+class CallbackMetric:
+    """Counter or gauge read on a scrape, for the stats kept by other
+    objects like the caches. `read` returns the value, or a dict of label
+    values to value.
+    """
+
+    def __init__(self, type: str, name: str, help: str, read: Callable, labelnames: Sequence[str] = ()):
+        self.type = type
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Metrics:
+    """Registry of the metrics of the service"""
+
+    def __init__(self):
+        # By name, in the order of registration
+        self._metrics = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def counter_func(self, name: str, help: str, read: Callable, labelnames: Sequence[str] = ()):
+        self._register(CallbackMetric("counter", name, help, read, labelnames))
+
+    def gauge_func(self, name: str, help: str, read: Callable, labelnames: Sequence[str] = ()):
+        self._register(CallbackMetric("gauge", name, help, read, labelnames))
+
+    def _register(self, metric):
+        """Returns the metric registered under the same name if any, eg. when
+        the app is started again in the same process. A callback metric
+        registered again reads from the new callback.
+        """
+        registered = self._metrics.get(metric.name)
+        if registered is None:
+            self._metrics[metric.name] = metric
+            return metric
+        if registered.type != metric.type or registered.labelnames != metric.labelnames:
+            raise ValueError(f"Metric {metric.name} is already registered with another type or labels")
+        if isinstance(registered, CallbackMetric):
+            registered.read = metric.read
+        return registered
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the count, latency and DB time of the
+    requests per route, and the requests in flight.
+
+    The route is the path template, eg. /products/{product_id}, so that the
+    number of series stays bounded. Requests which match no route are
+    recorded as "unmatched".
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.requests = metrics.counter(
+            "http_requests_total", "Requests served", ("method", "route", "status"),
+        )
+        self.latency = metrics.histogram(
+            "http_request_duration_seconds", "Time to serve the requests", ("method", "route"),
+        )
+        self.db_time = metrics.histogram(
+            "http_request_db_duration_seconds", "Time spent in DB queries per request", ("method", "route"),
+        )
+        self.in_flight = metrics.gauge(
+            "http_requests_in_flight", "Requests being served",
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        self.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight.dec()
+            _request_db_time.reset(token)
+
+            # Set by the router on the scope when a route matches
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            self.requests.inc(method, path, status_code)
+            self.latency.observe(elapsed, method, path)
+            self.db_time.observe(db_time[0], method, path)
+
+
+def instrument_engine(engine: sa.Engine, metrics: Metrics):
+    """Records the time of the queries run by the engine, adding it to the
+    DB time of the current request, and the usage of its connection pool.
+    """
+    queries = metrics.histogram("db_query_duration_seconds", "Time of the DB queries")
+
+    @sa.event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @sa.event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        queries.observe(elapsed)
+        db_time = _request_db_time.get()
+        if db_time is not None:
+            db_time[0] += elapsed
+
+    @sa.event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # The query failed, after_cursor_execute is not called
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    def pool_usage():
+        pool = engine.pool
+        if not isinstance(pool, QueuePool):
+            return {}
+        return {
+            ("checked_out",): pool.checkedout(),
+            ("checked_in",): pool.checkedin(),
+            ("overflow",): max(0, pool.overflow()),
+            ("size",): pool.size(),
+        }
+
+    metrics.gauge_func("db_pool_connections", "Connections of the DB pool", pool_usage, ("state",))
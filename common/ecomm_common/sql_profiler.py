@@ -0,0 +1,235 @@
+import logging
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import sqlalchemy as sa
+
+# Profiling of the SQL queries of the service, in place of echoing every
+# query. Every query is timed by the cursor events of the engine:
+#
+# - a query slower than `slow_query_seconds` is logged with its plan
+# - the queries of a sampled share of the requests are aggregated by
+#   fingerprint, the statement with its literals replaced by ?, and by route
+#
+# The aggregates are served by /internal/sql_profile, the statements which
+# took the most time first.
+
+# Queries of the request being profiled, set by SqlProfilerMiddleware for
+# the sampled requests. The handlers run in worker threads with a copy of
+# the context, the list is shared so that their queries add to it.
+_request_queries: ContextVar[Optional[List]] = ContextVar("request_queries", default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """The statement with its literals and bound parameters replaced by ?,
+    so that the runs of a query with different values are grouped.
+    """
+    text = _STRING_RE.sub("?", statement)
+    text = _PARAM_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    # IN lists of any length are the same query
+    text = _IN_LIST_RE.sub("(...)", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+class SqlProfiler:
+    """Times the queries run by the instrumented engines.
+
+    Slow queries are logged with their EXPLAIN plan, at most once per
+    `explain_interval` seconds per fingerprint. A share `sample_ratio` of the
+    requests is profiled, their queries are aggregated by fingerprint and
+    by route. At most `max_statements` fingerprints are tracked.
+    """
+
+    def __init__(
+        self,
+        sample_ratio: float = 0.0,
+        slow_query_seconds: float = 0.5,
+        explain: bool = True,
+        explain_interval: float = 60,
+        max_statements: int = 1000,
+    ):
+        self.configure(sample_ratio, slow_query_seconds, explain, explain_interval, max_statements)
+        # fingerprint -> count, total seconds, max seconds
+        self._statements: Dict[str, List] = {}
+        # route -> requests, queries, total seconds, max queries
+        self._routes: Dict[str, List] = {}
+        self._explained: Dict[str, float] = {}
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        sample_ratio: float,
+        slow_query_seconds: float,
+        explain: bool = True,
+        explain_interval: float = 60,
+        max_statements: int = 1000,
+    ):
+        self.sample_ratio = sample_ratio
+        self.slow_query_seconds = slow_query_seconds
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_statements = max_statements
+
+    def instrument(self, engine: sa.Engine):
+        @sa.event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+        @sa.event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["profiler_start"].pop()
+            queries = _request_queries.get()
+            if queries is not None:
+                queries.append((statement, elapsed))
+            if elapsed >= self.slow_query_seconds:
+                self._slow_query(conn, cursor, statement, parameters, executemany, elapsed)
+
+        @sa.event.listens_for(engine, "handle_error")
+        def handle_error(context):
+            conn = context.connection
+            if conn is not None and conn.info.get("profiler_start"):
+                conn.info["profiler_start"].pop()
+
+    def sample(self) -> bool:
+        return self.sample_ratio > 0 and random.random() < self.sample_ratio
+
+    def record_request(self, route: str, queries: List):
+        total = sum(elapsed for _, elapsed in queries)
+        with self._lock:
+            stats = self._routes.setdefault(route, [0, 0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += len(queries)
+            stats[2] += total
+            stats[3] = max(stats[3], len(queries))
+
+            for statement, elapsed in queries:
+                key = fingerprint(statement)
+                stats = self._statements.get(key)
+                if stats is None:
+                    if len(self._statements) >= self.max_statements:
+                        continue
+                    stats = self._statements[key] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def report(self, limit: int = 20) -> Dict:
+        with self._lock:
+            statements = [(key, *stats) for key, stats in self._statements.items()]
+            routes = [(route, *stats) for route, stats in self._routes.items()]
+            slow_queries = self.slow_queries
+
+        statements.sort(key=lambda s: s[2], reverse=True)
+        routes.sort(key=lambda r: r[3], reverse=True)
+        return {
+            "sample_ratio": self.sample_ratio,
+            "slow_queries": slow_queries,
+            "statements": [
+                {
+                    "statement": key,
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "mean_ms": round(total / count * 1000, 3),
+                    "max_ms": round(max_ * 1000, 3),
+                }
+                for key, count, total, max_ in statements[:limit]
+            ],
+            "routes": [
+                {
+                    "route": route,
+                    "requests": requests,
+                    "queries_per_request": round(queries / requests, 2),
+                    "max_queries": max_queries,
+                    "db_ms_per_request": round(total / requests * 1000, 3),
+                }
+                for route, requests, queries, total, max_queries in routes[:limit]
+            ],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._routes.clear()
+            self.slow_queries = 0
+
+    def _slow_query(self, conn, cursor, statement, parameters, executemany, elapsed):
+        key = fingerprint(statement)
+        now = time.monotonic()
+        with self._lock:
+            self.slow_queries += 1
+            explain = (
+                self.explain
+                and not executemany
+                and now - self._explained.get(key, -self.explain_interval) >= self.explain_interval
+            )
+            if explain:
+                self._explained[key] = now
+
+        plan = self._explain(conn, cursor, statement, parameters) if explain else ""
+        logging.warning(f"Slow query, {elapsed * 1000:.1f}ms: {key}" + (f"\n{plan}" if plan else ""))
+
+    def _explain(self, conn, cursor, statement, parameters) -> str:
+        dialect = conn.dialect.name
+        prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+        # A cursor of its own on the DBAPI connection, the events of the
+        # engine are not run for it and the result of the query is untouched
+        explain_cursor = cursor.connection.cursor()
+        # A failed statement aborts the transaction of the request in
+        # Postgres, the savepoint keeps it usable
+        savepoint = dialect == "postgresql"
+        try:
+            if savepoint:
+                explain_cursor.execute("SAVEPOINT sql_profiler_explain")
+            try:
+                explain_cursor.execute(prefix + statement, parameters)
+                plan = "\n".join(
+                    " ".join(str(column) for column in row) for row in explain_cursor.fetchall()
+                )
+            except Exception as e:
+                if savepoint:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT sql_profiler_explain")
+                return f"EXPLAIN failed: {e!r}"
+            if savepoint:
+                explain_cursor.execute("RELEASE SAVEPOINT sql_profiler_explain")
+            return plan
+        except Exception as e:
+            return f"EXPLAIN failed: {e!r}"
+        finally:
+            explain_cursor.close()
+
+
+class SqlProfilerMiddleware:
+    """ASGI middleware collecting the queries of a sample of the requests"""
+
+    def __init__(self, app, profiler: SqlProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.sample():
+            await self.app(scope, receive, send)
+            return
+
+        queries = []
+        token = _request_queries.set(queries)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_queries.reset(token)
+            # Set by the router on the scope when a route matches
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.profiler.record_request(f"{scope['method']} {route}", queries)
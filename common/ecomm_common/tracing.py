@@ -0,0 +1,293 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+
+# Tracing of the requests across the services with the W3C trace context,
+# https://www.w3.org/TR/trace-context/. The trace is passed to the next
+# service in the `traceparent` header:
+#
+#   00-<trace id, 32 hex>-<id of the parent span, 16 hex>-<flags, 01 if sampled>
+#
+# A request is traced if its caller traced it, otherwise with the probability
+# `sample_ratio`. The finished spans go to an exporter, a file of JSON lines
+# or an in-memory buffer, there is no tracing backend to run. When a request
+# is not traced the spans are a shared no-op object, the cost is a context
+# variable lookup per span.
+
+TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# Innermost span of the current request or task. Only sampled spans are set.
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Returns the trace id, parent span id and sampled flag of the header,
+    None if it is missing or invalid.
+    """
+    if not header:
+        return None
+    match = TRACEPARENT_RE.match(header.strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the current span, to pass the trace on"""
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+class Span:
+    """A timed operation of a trace. Used as a context manager, it is the
+    current span inside the block and is exported when the block exits.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str], kind: str, attributes: Optional[Dict]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+        self.start = 0.0
+        self.duration = 0.0
+        self._perf_start = 0.0
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._perf_start
+        _current_span.reset(self._token)
+        if exc is not None and self.error is None:
+            self.error = repr(exc)
+        self.tracer.export(self)
+        return False
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.tracer.service,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Span of a request which is not traced"""
+    traceparent = None
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class InMemoryExporter:
+    """Keeps the last `maxlen` spans, served by /internal/traces"""
+
+    def __init__(self, maxlen: int = 10_000):
+        self._spans = deque(maxlen=maxlen)
+
+    def export(self, span: Span):
+        self._spans.append(span.to_dict())
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Dict]:
+        spans = list(self._spans)
+        if trace_id:
+            spans = [span for span in spans if span["trace_id"] == trace_id]
+        return spans
+
+
+class FileExporter:
+    """Appends the spans to a file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Dict]:
+        return []
+
+
+class Tracer:
+    def __init__(self, service: str = "", sample_ratio: float = 0.0, exporter=None):
+        self.configure(service, sample_ratio, exporter)
+
+    def configure(self, service: str, sample_ratio: float, exporter=None):
+        self.service = service
+        self.sample_ratio = sample_ratio
+        self.exporter = exporter or InMemoryExporter()
+
+    def start_span(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        kind: str = "internal",
+        attributes: Optional[Dict] = None,
+    ):
+        """Starts a child of the current span. Without a current span, the
+        span continues the trace of `traceparent`, or starts a new trace if
+        the request is sampled.
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(self, name, parent.trace_id, parent.span_id, kind, attributes)
+
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id, sampled = remote
+            if not sampled:
+                return NOOP_SPAN
+            return Span(self, name, trace_id, parent_id, kind, attributes)
+
+        if self.sample_ratio <= 0 or random.random() >= self.sample_ratio:
+            return NOOP_SPAN
+        return Span(self, name, f"{random.getrandbits(128):032x}", None, kind, attributes)
+
+    def export(self, span: Span):
+        self.exporter.export(span)
+
+
+def create_exporter(kind: str, path: str, maxlen: int):
+    if kind == "file":
+        return FileExporter(path)
+    return InMemoryExporter(maxlen)
+
+
+# Tracer of the process, configured at startup
+tracer = Tracer()
+
+
+def traced(fn):
+    """Runs the function in a span named after it when the request is
+    traced.
+    """
+    name = fn.__qualname__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return fn(*args, **kwargs)
+        with tracer.start_span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class TracingMiddleware:
+    """ASGI middleware running every request in a server span, which
+    continues the trace of the `traceparent` header of the request.
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        span = self.tracer.start_span(
+            f"{scope['method']} {scope['path']}", traceparent=traceparent, kind="server",
+        )
+        if span is NOOP_SPAN:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        with span:
+            span.set_attribute("http.method", scope["method"])
+            span.set_attribute("http.target", scope["path"])
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # Set by the router on the scope when a route matches
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"{scope['method']} {route.path}"
+                    span.set_attribute("http.route", route.path)
+
+
+def trace_engine(engine: sa.Engine):
+    """Runs the queries of the traced requests in spans"""
+
+    @sa.event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_span.get() is None:
+            return
+        span = tracer.start_span("db.query", kind="client", attributes={
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:1000],
+            "db.executemany": executemany,
+        })
+        conn.info.setdefault("trace_spans", []).append(span.__enter__())
+
+    @sa.event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            spans.pop().__exit__(None, None, None)
+
+    @sa.event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        conn = context.connection
+        spans = conn.info.get("trace_spans") if conn is not None else None
+        if spans:
+            span = spans.pop()
+            span.error = repr(context.original_exception)
+            span.__exit__(None, None, None)
@@ -1,16 +1,20 @@
+import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 import jwt
 from cryptography.hazmat.primitives import serialization
 from config import AppConfig
 
-def generate_jwt():
+def generate_jwt(admin: bool = False):
     now = datetime.utcnow()
     payload = {
         "iat": now.timestamp(),
         "exp": (now + timedelta(hours=24)).timestamp(),
-        "user_id": "1", 
+        "user_id": "1",
     }
+    if admin:
+        # Back-office token, can export the orders of all the users
+        payload["iss"] = AppConfig().ORDERS_ADMIN_TOKEN_ISSUER
 
     private_key_text = Path(AppConfig().AUTH_JWT_PRIVATE_KEY_FILE).read_text()
     private_key = serialization.load_pem_private_key(
@@ -19,5 +23,4 @@ def generate_jwt():
     )
     return jwt.encode(payload=payload, key=private_key, algorithm="RS256")
 
-print(generate_jwt())
-
+print(generate_jwt(admin="--admin" in sys.argv[1:]))
@@ -2,10 +2,102 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class AppConfig(BaseSettings):
     ORDERS_DB_URL: str = 'sqlite:///orders.db'
+    ORDERS_DB_ECHO: bool = False
+    # Share of the requests whose queries are aggregated for
+    # /internal/sql_profile. The queries slower than SLOW_QUERY_SECONDS are
+    # logged, with their plan if EXPLAIN_SLOW_QUERIES is set.
+    ORDERS_DB_PROFILE_SAMPLE_RATIO: float = 0.01
+    ORDERS_DB_SLOW_QUERY_SECONDS: float = 0.5
+    ORDERS_DB_EXPLAIN_SLOW_QUERIES: bool = True
+    # Connection pool of the orders DB. Size the pool such that
+    # (POOL_SIZE + MAX_OVERFLOW) * workers stays below max_connections of the DB
+    ORDERS_DB_POOL_SIZE: int = 5
+    ORDERS_DB_MAX_OVERFLOW: int = 10
+    ORDERS_DB_POOL_PRE_PING: bool = True
+    # Seconds after which a connection is recycled, -1 to disable
+    ORDERS_DB_POOL_RECYCLE: int = 1800
     PRODUCT_SRV_HOST: str = 'http://localhost'
     PRODUCT_SRV_PORT: str = '8002'
     AUTH_JWT_PUBLIC_KEY_FILE: str = 'public_key.pem'
     AUTH_JWT_PRIVATE_KEY_FILE: str = 'private_key.pem'
+    # RS256, ES256 or EdDSA. Has to match the type of the keys and the
+    # algorithm configured in the other services.
+    AUTH_JWT_ALGORITHM: str = 'RS256'
+    # Number of verified tokens cached by the service, 0 to disable the cache
+    AUTH_JWT_CACHE_SIZE: int = 10000
+    # Bearer token of /internal/* and /metrics, they are not served without
+    # one. Give it to the monitoring, eg. the Prometheus scrape config.
+    INTERNAL_API_TOKEN: str | None = None
+    # Page size of GET /orders if the client doesn't ask for one, and the max
+    # page size a client can ask for
+    ORDERS_PAGE_SIZE: int = 20
+    ORDERS_MAX_PAGE_SIZE: int = 100
+    # Rows fetched at a time by GET /orders/export
+    ORDERS_EXPORT_CHUNK_SIZE: int = 1000
+    # Issuer (iss) of the back-office tokens. Their holders are admins, they
+    # can export the orders of all the users. The users service only issues
+    # buyer and seller tokens.
+    ORDERS_ADMIN_TOKEN_ISSUER: str = 'backoffice'
+    # Connection pool of the http client used to call the products service
+    PRODUCT_SRV_MAX_CONNECTIONS: int = 100
+    PRODUCT_SRV_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    PRODUCT_SRV_KEEPALIVE_EXPIRY: float = 30.0
+    # Timeouts of the calls to the products service, in seconds. POOL is the
+    # wait for a free connection of the pool.
+    PRODUCT_SRV_CONNECT_TIMEOUT: float = 1.0
+    PRODUCT_SRV_READ_TIMEOUT: float = 5.0
+    PRODUCT_SRV_WRITE_TIMEOUT: float = 5.0
+    PRODUCT_SRV_POOL_TIMEOUT: float = 1.0
+    # A failed call is retried MAX_RETRIES times after a random delay of up to
+    # BACKOFF * 2 ** retry seconds, capped at BACKOFF_MAX. The retries are
+    # limited to BUDGET_RATIO of the calls of the last 10 seconds plus
+    # BUDGET_MIN_PER_SECOND.
+    PRODUCT_SRV_MAX_RETRIES: int = 2
+    PRODUCT_SRV_RETRY_BACKOFF_SECONDS: float = 0.1
+    PRODUCT_SRV_RETRY_BACKOFF_MAX_SECONDS: float = 2.0
+    PRODUCT_SRV_RETRY_BUDGET_RATIO: float = 0.1
+    PRODUCT_SRV_RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    # The calls fail fast for RESET_TIMEOUT seconds after FAILURE_THRESHOLD
+    # consecutive failures of the products service
+    PRODUCT_SRV_BREAKER_FAILURE_THRESHOLD: int = 5
+    PRODUCT_SRV_BREAKER_RESET_TIMEOUT_SECONDS: float = 30.0
+    # Items booked per call to the products service and the number of such
+    # calls made concurrently for an order. The batches of an order are
+    # released by their ids, don't change the batch size while there are
+    # orders to be booked or cancelled.
+    PRODUCT_SRV_BOOKING_BATCH_SIZE: int = 50
+    PRODUCT_SRV_BOOKING_CONCURRENCY: int = 4
+    # Lifetime of the token used to call the products service. The token is
+    # cached and signed again REFRESH_MARGIN seconds before it expires.
+    PRODUCT_SRV_TOKEN_TTL_SECONDS: int = 24 * 60 * 60
+    PRODUCT_SRV_TOKEN_REFRESH_MARGIN_SECONDS: int = 60 * 60
+    # The products of an order are booked by a background worker reading the
+    # outbox. The worker is woken up by new orders and polls every
+    # POLL_INTERVAL seconds for retries and the events of other processes.
+    ORDERS_OUTBOX_POLL_INTERVAL_SECONDS: float = 1.0
+    ORDERS_OUTBOX_BATCH_SIZE: int = 50
+    ORDERS_OUTBOX_CONCURRENCY: int = 10
+    # Seconds after which an event claimed by a worker can be claimed again
+    ORDERS_OUTBOX_LEASE_SECONDS: int = 60
+    # Failed events are retried with an exponential backoff, the order is
+    # cancelled after MAX_ATTEMPTS
+    ORDERS_OUTBOX_MAX_ATTEMPTS: int = 10
+    ORDERS_OUTBOX_RETRY_BACKOFF_SECONDS: float = 1.0
+    # Seconds between the runs of the job which releases the stock of the
+    # cancelled orders whose release failed
+    ORDERS_RELEASE_RECONCILE_INTERVAL_SECONDS: float = 5 * 60
+    # Responses of POST /orders made with an Idempotency-Key are replayed for
+    # TTL seconds. The expired keys are purged every PURGE_INTERVAL seconds.
+    ORDERS_IDEMPOTENCY_KEY_TTL_SECONDS: int = 24 * 60 * 60
+    ORDERS_IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 60 * 60
+    # Share of the requests which are traced, 0 turns the tracing off. A
+    # request traced by its caller is always traced. The spans are kept in
+    # memory for /internal/traces, or appended to TRACING_FILE with the
+    # "file" exporter.
+    TRACING_SAMPLE_RATIO: float = 0.0
+    TRACING_EXPORTER: str = "memory"
+    TRACING_FILE: str = "spans.jsonl"
+    TRACING_MEMORY_SPANS: int = 10000
 
     # model_config = SettingsConfigDict(env_file=".env")
 
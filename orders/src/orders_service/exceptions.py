@@ -3,3 +3,28 @@ class OrderNotFoundException(Exception):
 
 class ProductNotBookedException(Exception):
     pass
+
+class OrderNotCancellableException(Exception):
+    pass
+
+class ProductServiceUnavailableException(Exception):
+    pass
+
+class ProductServiceRejectedException(Exception):
+    """The products service rejected the call, eg. the service token (401,
+    403) or the payload (422). Retrying doesn't help, it's a bug or a
+    misconfiguration of the orders service.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"Rejected with {status_code}: {detail}")
+        self.status_code = status_code
+
+class ProductServiceCircuitOpenException(ProductServiceUnavailableException):
+    """The products service is failing, the calls are not attempted till
+    `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
@@ -0,0 +1,12 @@
+from typing import Dict
+
+
+class StoredResponse:
+    """Response of a request made with an Idempotency-Key. Replays of the
+    request get this response instead of being processed again.
+    """
+
+    def __init__(self, fingerprint: str, status_code: int, response: Dict):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.response = response
@@ -3,6 +3,8 @@ from enum import Enum
 from datetime import datetime
 
 class OrderStatus(Enum):
+    # Written, the products are not booked yet
+    PENDING = "PENDING"
     CREATED = "CREATED"
     PAID = "PAID"
     PROGRESS = "PROGRESS"
@@ -1,56 +1,133 @@
-import logging
-from typing import List
-from datetime import datetime, timedelta
-from pathlib import Path
-import requests
-import jwt
-from cryptography.hazmat.primitives import serialization
-from orders_service.exceptions import ProductNotBookedException
+from typing import Iterator, List
+from ecomm_common.tracing import traced
 from repository.orders_repository import OrdersRepository
-from orders_service.orders import OrderItem
-from config import AppConfig
+from repository.outbox_repository import OutboxRepository
+from orders_service.exceptions import OrderNotCancellableException
+from orders_service.orders import Order, OrderItem, OrderStatus
+from orders_service.outbox import OutboxEventType
+from orders_service.ports import ProductsPort
+
+# Orders which can be cancelled, the stock booked for them is released
+CANCELLABLE_STATUSES = (OrderStatus.PENDING, OrderStatus.CREATED)
 
 
 class OrdersService:
+    """Placing an order is a saga across the orders and the products
+    services:
+
+    1. the order is written in PENDING state with a BOOK_PRODUCTS event
+    2. the outbox worker books the products, the order moves to CREATED if
+       all of them are booked
+    3. otherwise, or if the order is cancelled later, the order moves to
+       CANCELLED with a RELEASE_PRODUCTS event and the worker gives back
+       whatever was booked
+
+    Every step which calls the products service goes through the outbox, so
+    it is retried till it goes through.
+    """
+
     def __init__(
         self,
         orders_repository: OrdersRepository,
+        products_client: ProductsPort | None = None,
+        outbox_repository: OutboxRepository | None = None,
     ):
         self.orders_repository = orders_repository
+        self.products_client = products_client
+        self.outbox_repository = outbox_repository
+
+    @traced
+    def place_order(self, items: List[OrderItem], user_id: int) -> Order:
+        """Writes the order in PENDING state along with an outbox event to
+        book its products. Both are committed by the caller in the same
+        transaction, the products are booked later by the outbox worker.
+        """
+        order = self.orders_repository.add(items, user_id)
+        self.outbox_repository.add(OutboxEventType.BOOK_PRODUCTS, order)
+
+        return order
+
+
+    async def book_products(self, order: Order) -> List[OrderItem]:
+        """Books the products of the order and returns the booked items.
+        Safe to retry, the products service books an order only once.
+        """
+        return await self.products_client.book(
+            order.items, reservation_id=reservation_id(order),
+        )
+
+
+    async def release_products(self, order: Order):
+        """Gives back the stock booked for the order. Safe to retry."""
+        await self.products_client.release(
+            order.items, reservation_id=reservation_id(order),
+        )
+
+
+    def complete_booking(self, order_id, booked_items: List[OrderItem]):
+        """Moves the PENDING order to CREATED if all of its items were
+        booked. Otherwise the order is cancelled and the booked items are
+        released.
+        """
+        order = self.orders_repository.get_order(order_id)
+        if order.status != OrderStatus.PENDING:
+            # Already completed by an earlier attempt, or cancelled
+            return
+
+        if len(booked_items) < len(order.items):
+            self.cancel_booking(order_id)
+            return
+
+        self.orders_repository.update_status(
+            order_id, OrderStatus.CREATED, status=OrderStatus.PENDING,
+        )
 
-    def place_order(self, items: List[OrderItem], user_id: int):
-        # book iterms from the product service
-        # TODO: Batch api to book items in product service
-        PRODUCT_SRV_URL = f"{AppConfig().PRODUCT_SRV_HOST}:{AppConfig().PRODUCT_SRV_PORT}"
-
-        # TODO: Write orders and order_items to DB in INIT state. 
-        # Then call products api. Update the order_items status as per the resp.
-
-        token = gen_token_for_product_srv(AppConfig().AUTH_JWT_PRIVATE_KEY_FILE)
-        booked_items = []
-        for item in items:
-            try:
-                headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                }
-                # TODO: Keep the logic to call ProductSrv outside of business logic.
-                resp = requests.post(
-                    f'{PRODUCT_SRV_URL}/products/{item.product_id}/buy?order_quantity={item.quantity}',
-                    headers = headers,
-                )
-                resp.raise_for_status()
-                booked_items.append(item)
-
-            except requests.exceptions.HTTPError as http_err:
-                logging.error(f"ERROR: Http error in booking product: {http_err}")
-            except requests.exceptions.RequestException as err:
-                logging.error(f"ERROR: Error in booking product: {err}")
-
-        if len(booked_items) == 0:
-            raise ProductNotBookedException("No items can be booked in product service.")
-
-        return self.orders_repository.add(booked_items, user_id)
+
+    def cancel_booking(self, order_id):
+        """Cancels the PENDING order, eg. when its products can't be booked"""
+        order = self.orders_repository.get_order(order_id)
+        if self.orders_repository.update_status(
+            order_id, OrderStatus.CANCELLED, status=OrderStatus.PENDING,
+        ):
+            self.outbox_repository.add(OutboxEventType.RELEASE_PRODUCTS, order)
+
+
+    @traced
+    def cancel_order(self, order_id, **filters) -> Order:
+        """Cancels the order on behalf of the user. The stock booked for the
+        order is released by the outbox worker.
+        """
+        order = self.orders_repository.get_order(order_id, **filters)
+        if order.status not in CANCELLABLE_STATUSES:
+            raise OrderNotCancellableException(
+                f"Order in {order.status.value} state can't be cancelled"
+            )
+
+        # Compare and set, the outbox worker may be moving the order from
+        # PENDING to CREATED concurrently
+        if not self.orders_repository.update_status(
+            order_id, OrderStatus.CANCELLED, status=order.status,
+        ):
+            raise OrderNotCancellableException("Order was updated concurrently")
+
+        self.outbox_repository.add(OutboxEventType.RELEASE_PRODUCTS, order)
+        order.status = OrderStatus.CANCELLED
+
+        return order
+
+
+    def reconcile_releases(self, limit: int) -> int:
+        """Schedules the release of the cancelled orders whose release gave
+        up, or was never scheduled. Returns the number of orders scheduled.
+        """
+        order_ids = self.outbox_repository.orders_without_event(
+            OutboxEventType.RELEASE_PRODUCTS, OrderStatus.CANCELLED, limit,
+        )
+        for order_id in order_ids:
+            order = self.orders_repository.get_order(order_id)
+            self.outbox_repository.add(OutboxEventType.RELEASE_PRODUCTS, order)
+
+        return len(order_ids)
 
 
     def get_order(self, order_id, **filters):
@@ -59,19 +136,17 @@ class OrdersService:
 
     def list_orders(self, **filters):
         limit = filters.pop("limit", None)
-        return self.orders_repository.list_orders(limit=limit, **filters)
-
-
-def gen_token_for_product_srv(private_key_file) -> str:
-    now = datetime.utcnow()
-    payload = {
-        "iss": "order_srv",
-        "exp": (now + timedelta(hours=24)).timestamp(),
-    }
-
-    private_key_text = Path(private_key_file).read_text()
-    private_key = serialization.load_pem_private_key(
-        private_key_text.encode(),
-        password=None,
-    )
-    return jwt.encode(payload=payload, key=private_key, algorithm="RS256")
+        after = filters.pop("after", None)
+        return self.orders_repository.list_orders(limit=limit, after=after, **filters)
+
+
+    def export_orders(self, chunk_size: int, **filters) -> Iterator[Order]:
+        """Yields the orders one at a time, for exports which don't fit in
+        memory.
+        """
+        return self.orders_repository.iter_orders(chunk_size, **filters)
+
+
+def reservation_id(order: Order) -> str:
+    # The created_at keeps the ids unique if the orders DB is ever recreated
+    return f"order-{order.id}-{order.created_at:%Y%m%d%H%M%S%f}"
@@ -0,0 +1,35 @@
+from enum import Enum
+
+
+class OutboxEventType(Enum):
+    BOOK_PRODUCTS = "BOOK_PRODUCTS"
+    # Gives back the stock booked for a cancelled order
+    RELEASE_PRODUCTS = "RELEASE_PRODUCTS"
+
+
+class OutboxEventStatus(Enum):
+    PENDING = "PENDING"
+    DONE = "DONE"
+    # Gave up after too many attempts, or rejected by the products service
+    FAILED = "FAILED"
+
+
+class OutboxEvent:
+    """Work to be done after the transaction which wrote the event commits,
+    eg. booking the products of an order. The event is written in the same
+    transaction as the order so neither can exist without the other.
+    """
+
+    def __init__(
+        self,
+        id: int,
+        order_id: int,
+        event_type: OutboxEventType,
+        attempts: int,
+        traceparent: str | None = None,
+    ):
+        self.id = id
+        self.order_id = order_id
+        self.event_type = event_type
+        self.attempts = attempts
+        self.traceparent = traceparent
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from ecomm_common.tracing import tracer
+from orders_service.exceptions import (
+    ProductServiceCircuitOpenException,
+    ProductServiceRejectedException,
+)
+from orders_service.orders import OrderStatus
+from orders_service.orders_service import OrdersService
+from orders_service.outbox import OutboxEvent, OutboxEventType
+from orders_service.ports import ProductsPort
+from repository.orders_repository import OrdersRepository
+from repository.outbox_repository import OutboxRepository
+
+
+class OutboxWorker:
+    """Processes the outbox events written along with the orders.
+
+    Runs as a background task of the orders service. The events are claimed
+    with a lease so that more than one process can run the worker, and an
+    event whose worker died is processed again once its lease expires. The DB
+    calls are blocking, they run in a thread with a session per step so that
+    no connection is held while waiting for the products service.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        products_client: ProductsPort,
+        batch_size: int = 50,
+        concurrency: int = 10,
+        poll_interval: float = 1.0,
+        lease: timedelta = timedelta(seconds=60),
+        max_attempts: int = 10,
+        retry_backoff: float = 1.0,
+    ):
+        self.session_factory = session_factory
+        self.products_client = products_client
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._wakeup = asyncio.Event()
+
+    def notify(self):
+        """Wakes up the worker instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.process_due()
+            except Exception:
+                logging.exception("ERROR: Error in processing the outbox")
+                processed = 0
+
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_due(self) -> int:
+        """Processes the events which are due and returns their count."""
+        events = await asyncio.to_thread(self._claim_due)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(event: OutboxEvent):
+            async with semaphore:
+                await self._process(event)
+
+        await asyncio.gather(*(process(event) for event in events))
+        return len(events)
+
+    def _claim_due(self):
+        with self.session_factory() as session:
+            events = OutboxRepository(session).claim_due(self.batch_size, self.lease)
+            session.commit()
+            return events
+
+    async def _process(self, event: OutboxEvent):
+        # Continues the trace of the request which placed or cancelled the
+        # order, the DB calls in the worker threads see the span too
+        with tracer.start_span(
+            f"outbox {event.event_type.value}",
+            traceparent=event.traceparent,
+            kind="consumer",
+            attributes={"order.id": event.order_id, "outbox.attempts": event.attempts},
+        ):
+            await self._process_event(event)
+
+    async def _process_event(self, event: OutboxEvent):
+        try:
+            order = await asyncio.to_thread(self._get_order, event.order_id)
+            service = OrdersService(None, self.products_client)
+
+            if event.event_type == OutboxEventType.BOOK_PRODUCTS:
+                booked_items = []
+                # Don't book the products of an order cancelled meanwhile
+                if order.status == OrderStatus.PENDING:
+                    booked_items = await service.book_products(order)
+                await asyncio.to_thread(self._complete_booking, event, booked_items)
+
+            elif event.event_type == OutboxEventType.RELEASE_PRODUCTS:
+                await service.release_products(order)
+                await asyncio.to_thread(self._complete, event)
+
+            else:
+                logging.error(f"ERROR: Unknown outbox event {event.event_type}")
+
+        except ProductServiceCircuitOpenException as err:
+            # The products service is down, try again when the circuit lets
+            # the calls through. Doesn't count as an attempt, the orders are
+            # not cancelled because of an outage.
+            await asyncio.to_thread(
+                self._postpone, event, max(err.retry_after, self.poll_interval),
+            )
+        except ProductServiceRejectedException as err:
+            # A bug or a misconfiguration, eg. the service token. Retrying
+            # doesn't help, and the order must not be cancelled as if it was
+            # out of stock. The event is left failed with the error.
+            logging.error(f"ERROR: Outbox event {event.id} rejected by the products service: {err}")
+            await asyncio.to_thread(self._fail, event, repr(err))
+        except Exception as err:
+            logging.error(f"ERROR: Outbox event {event.id} failed: {err!r}")
+            await asyncio.to_thread(self._retry_later, event, repr(err))
+
+    def _get_order(self, order_id):
+        with self.session_factory() as session:
+            return OrdersService(OrdersRepository(session)).get_order(order_id)
+
+    def _complete_booking(self, event: OutboxEvent, booked_items):
+        # The order and the event are updated in one transaction
+        with self.session_factory() as session:
+            self._service(session).complete_booking(event.order_id, booked_items)
+            OutboxRepository(session).complete(event.id)
+            session.commit()
+
+    def _complete(self, event: OutboxEvent):
+        with self.session_factory() as session:
+            OutboxRepository(session).complete(event.id)
+            session.commit()
+
+    def _service(self, session) -> OrdersService:
+        return OrdersService(
+            OrdersRepository(session),
+            outbox_repository=OutboxRepository(session),
+        )
+
+    def _postpone(self, event: OutboxEvent, delay: float):
+        with self.session_factory() as session:
+            OutboxRepository(session).postpone(event, timedelta(seconds=delay))
+            session.commit()
+
+    def _fail(self, event: OutboxEvent, error: str):
+        with self.session_factory() as session:
+            OutboxRepository(session).fail(event, error)
+            session.commit()
+
+    def _retry_later(self, event: OutboxEvent, error: str):
+        with self.session_factory() as session:
+            outbox = OutboxRepository(session)
+            if event.attempts + 1 >= self.max_attempts:
+                # Give up. An order which can't be booked is cancelled, a
+                # release which gave up is scheduled again by the
+                # reconciliation job.
+                if event.event_type == OutboxEventType.BOOK_PRODUCTS:
+                    self._service(session).cancel_booking(event.order_id)
+                outbox.fail(event, error)
+            else:
+                delay = min(self.retry_backoff * 2 ** event.attempts, 300)
+                outbox.retry_later(event, error, timedelta(seconds=delay))
+            session.commit()
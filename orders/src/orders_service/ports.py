@@ -0,0 +1,27 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+from orders_service.orders import OrderItem
+
+
+# Interfaces of the external services used by the business layer. The
+# adapters implementing them live outside orders_service, eg. the products
+# service http client in products_client.
+
+class ProductsPort(ABC):
+
+    @abstractmethod
+    async def book(self, items: List[OrderItem], reservation_id: str) -> List[OrderItem]:
+        """Books the items under the reservation id and returns the ones
+        which could be booked. Booking the same reservation id again returns
+        the same result. Raises ProductServiceUnavailableException if the
+        products service can't be reached, and ProductServiceRejectedException
+        if it rejects the call.
+        """
+
+    @abstractmethod
+    async def release(self, items: List[OrderItem], reservation_id: str):
+        """Gives back the stock booked under the reservation id. Raises
+        ProductServiceUnavailableException if the products service can't be
+        reached, and ProductServiceRejectedException if it rejects the call.
+        """
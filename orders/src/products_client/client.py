@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List
+
+import httpx
+
+from ecomm_common.tracing import tracer
+from orders_service.exceptions import (
+    ProductServiceCircuitOpenException,
+    ProductServiceRejectedException,
+    ProductServiceUnavailableException,
+)
+from orders_service.orders import OrderItem
+from orders_service.ports import ProductsPort
+from products_client.resilience import BreakerState, CircuitBreaker, RetryBudget
+from products_client.service_token import ServiceTokenProvider
+
+# 4xx of the products service which go away on a retry, eg. the 409 of a
+# release racing with the booking of the same reservation. The other ones
+# are raised as ProductServiceRejectedException.
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 429})
+
+class ProductsClient(ProductsPort):
+    """Adapter to book products in the products service.
+
+    The underlying httpx.AsyncClient is shared by all the requests so that the
+    connections to the products service are pooled and kept alive. Large
+    carts are split in batches which are booked concurrently, at most
+    `max_concurrency` batches at a time per order.
+
+    The timeouts of the calls are the ones of the http client. Failed calls
+    are retried `max_retries` times with jittered exponential backoff as
+    long as the retry budget allows it, booking and releasing are
+    idempotent so the retries are safe. The circuit breaker stops the calls
+    while the products service keeps failing.
+
+    The latency of every call, retries included, is recorded in the
+    `latency` histogram if one is given.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        token_provider: ServiceTokenProvider,
+        batch_size: int = 50,
+        max_concurrency: int = 4,
+        max_retries: int = 2,
+        retry_backoff: float = 0.1,
+        retry_backoff_max: float = 2.0,
+        retry_budget: RetryBudget | None = None,
+        breaker: CircuitBreaker | None = None,
+        latency=None,
+    ):
+        self.http_client = http_client
+        self.token_provider = token_provider
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency
+
+    async def book(self, items: List[OrderItem], reservation_id: str) -> List[OrderItem]:
+        """Books the items and returns the ones which could be booked.
+
+        Every batch is sent with a reservation id derived from
+        `reservation_id`, so calling this again for the same order returns the
+        earlier result instead of booking the products twice. Raises
+        ProductServiceUnavailableException if a batch could not be booked, the
+        caller is expected to retry, and ProductServiceRejectedException if
+        the products service rejected it.
+        """
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def book_batch(batch_id: str, batch: List[OrderItem]) -> List[OrderItem]:
+            async with semaphore:
+                resp = await self._post('/products/buy', {
+                    "items": [
+                        {"product_id": item.product_id, "quantity": item.quantity}
+                        for item in batch
+                    ],
+                    "allow_partial": True,
+                    "reservation_id": batch_id,
+                })
+
+            booked = []
+            # The results are in the same order as the requested items
+            for item, result in zip(batch, resp.json()["items"]):
+                if result["booked"]:
+                    booked.append(item)
+                else:
+                    logging.error(
+                        f"ERROR: Product {item.product_id} not booked: {result['detail']}"
+                    )
+            return booked
+
+        results = await asyncio.gather(
+            *(book_batch(batch_id, batch)
+              for batch_id, batch in self._batches(items, reservation_id))
+        )
+
+        return [item for booked in results for item in booked]
+
+    async def release(self, items: List[OrderItem], reservation_id: str):
+        """Gives back the stock booked by `book` for the same items and
+        reservation id. Safe to call even if nothing was booked, a booking
+        which arrives after the release doesn't book anything. Raises
+        ProductServiceUnavailableException if the release didn't go through,
+        and ProductServiceRejectedException if it was rejected.
+        """
+        batch_ids = [batch_id for batch_id, _ in self._batches(items, reservation_id)]
+        await self._post('/products/release', {"reservation_ids": batch_ids})
+
+    def stats(self):
+        return {
+            "breaker": self.breaker.stats(),
+            "retry_budget": self.retry_budget.stats(),
+        }
+
+    async def _post(self, path: str, payload: Dict) -> httpx.Response:
+        self.retry_budget.record_request()
+        retries = 0
+        while True:
+            if not self.breaker.allow():
+                raise ProductServiceCircuitOpenException(self.breaker.retry_after())
+            # Only the trial call is let through while half open
+            trial = self.breaker.state == BreakerState.HALF_OPEN
+
+            start = time.perf_counter()
+            try:
+                try:
+                    resp = await self._send(path, payload)
+                finally:
+                    # The breaker would reject every call if the trial ended
+                    # with another error, eg. cancelled. The outcome of the
+                    # call is recorded below.
+                    if trial:
+                        self.breaker.release_trial()
+            except httpx.TransportError as err:
+                # Includes the timeouts
+                self._observe(path, start, "error")
+                self.breaker.record_failure()
+                error = err
+            else:
+                self._observe(path, start, resp.status_code)
+                if resp.status_code < 500:
+                    # The service is up, a 4xx is a problem with the request
+                    self.breaker.record_success()
+                    if resp.is_success:
+                        return resp
+                    if resp.status_code not in RETRYABLE_STATUSES:
+                        logging.error(f"ERROR: {path} rejected with {resp.status_code}: {resp.text}")
+                        raise ProductServiceRejectedException(resp.status_code, resp.text)
+                else:
+                    self.breaker.record_failure()
+                error = httpx.HTTPStatusError(
+                    f"Http error {resp.status_code}", request=resp.request, response=resp,
+                )
+
+            logging.error(f"ERROR: Error in calling {path}: {error!r}")
+            if retries >= self.max_retries or not self.retry_budget.try_retry():
+                raise ProductServiceUnavailableException(str(error)) from error
+
+            retries += 1
+            # Full jitter, the retries of concurrent calls don't line up
+            await asyncio.sleep(random.uniform(
+                0, min(self.retry_backoff_max, self.retry_backoff * 2 ** retries),
+            ))
+
+    async def _send(self, path: str, payload: Dict) -> httpx.Response:
+        with tracer.start_span(f"POST {path}", kind="client") as span:
+            headers = self._headers()
+            if span.traceparent:
+                # The products service continues the trace
+                headers["traceparent"] = span.traceparent
+            resp = await self.http_client.post(path, headers=headers, json=payload)
+            span.set_attribute("http.status_code", resp.status_code)
+            return resp
+
+    def _observe(self, path: str, start: float, status):
+        if self.latency is not None:
+            self.latency.observe(time.perf_counter() - start, path, status)
+
+    def _headers(self):
+        token = self.token_provider.get_token()
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+
+    def _batches(self, items: List[OrderItem], reservation_id: str):
+        # The batch ids depend on the batch size, it must not change while
+        # there are orders to be booked or released.
+        for no, i in enumerate(range(0, len(items), self.batch_size)):
+            yield f"{reservation_id}/{no}", items[i:i + self.batch_size]
@@ -0,0 +1,126 @@
+import enum
+import time
+from collections import deque
+
+
+class BreakerState(enum.Enum):
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    # Letting a single call through to check if the service is back
+    HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitBreaker:
+    """Stops calling a service after `failure_threshold` consecutive failures.
+
+    While the circuit is open the calls fail fast instead of waiting for
+    timeouts. After `reset_timeout` seconds one trial call is let through,
+    its outcome closes or opens the circuit again. The caller releases the
+    trial with `release_trial` if the call ends without an outcome. Not thread safe, it's
+    used from the event loop only.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == BreakerState.OPEN and self.retry_after() == 0:
+            self.state = BreakerState.HALF_OPEN
+            self.trial_in_flight = False
+
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+
+        self.rejected += 1
+        return False
+
+    def release_trial(self):
+        """Gives back the slot of a trial call which ended without an
+        outcome, eg. cancelled, so that another call can be the trial.
+        """
+        self.trial_in_flight = False
+
+    def record_success(self):
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == BreakerState.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                self.times_opened += 1
+            self.state = BreakerState.OPEN
+            self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+    def retry_after(self) -> float:
+        """Seconds till a call is let through again"""
+        if self.state != BreakerState.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def stats(self):
+        return {
+            "state": self.state.value,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after(),
+        }
+
+
+class RetryBudget:
+    """Limits the retries to `ratio` of the requests made in the last
+    `window` seconds, plus `min_per_second` retries so that a quiet client
+    can still retry.
+
+    Without a budget every caller retries when the service degrades, and the
+    retries multiply the load on the service when it's least able to take
+    it. Not thread safe, it's used from the event loop only.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, window: float = 10.0, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.clock = clock
+        self._requests = deque()
+        self._retries = deque()
+        self.exhausted = 0
+
+    def record_request(self):
+        self._requests.append(self.clock())
+
+    def try_retry(self) -> bool:
+        """Returns True and counts the retry if the budget allows it"""
+        now = self.clock()
+        for calls in (self._requests, self._retries):
+            while calls and calls[0] <= now - self.window:
+                calls.popleft()
+
+        allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+        if len(self._retries) >= allowed:
+            self.exhausted += 1
+            return False
+
+        self._retries.append(now)
+        return True
+
+    def stats(self):
+        return {
+            "requests_in_window": len(self._requests),
+            "retries_in_window": len(self._retries),
+            "exhausted": self.exhausted,
+        }
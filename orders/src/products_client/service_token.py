@@ -0,0 +1,65 @@
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+
+
+class ServiceTokenProvider:
+    """Provides the token used by the orders service to call the products
+    service.
+
+    The private key is loaded once and the signed token is reused until it
+    gets close to its expiry, so booking products doesn't read the key from
+    disk or sign a token on every order. Safe to share between threads and
+    coroutines: signing happens under a lock and nothing is awaited while
+    holding it.
+    """
+
+    def __init__(
+        self,
+        private_key_file: str,
+        algorithm: str = "RS256",
+        ttl: timedelta = timedelta(hours=24),
+        refresh_margin: timedelta = timedelta(hours=1),
+        issuer: str = "order_srv",
+    ):
+        private_key_text = Path(private_key_file).read_text()
+        self._private_key = serialization.load_pem_private_key(
+            private_key_text.encode(),
+            password=None,
+        )
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.issuer = issuer
+        self._lock = threading.Lock()
+        # (token, refresh_at) are swapped together so a reader never sees a
+        # token with the refresh time of another one.
+        self._cached: tuple[str, float] | None = None
+
+    def get_token(self) -> str:
+        cached = self._cached
+        if cached is not None and time.time() < cached[1]:
+            return cached[0]
+
+        with self._lock:
+            # Another thread may have refreshed it while we were waiting
+            cached = self._cached
+            if cached is None or time.time() >= cached[1]:
+                cached = self._sign()
+                self._cached = cached
+            return cached[0]
+
+    def _sign(self) -> tuple[str, float]:
+        now = time.time()
+        expires_at = now + self.ttl.total_seconds()
+        payload = {
+            "iss": self.issuer,
+            "iat": now,
+            "exp": expires_at,
+        }
+        token = jwt.encode(payload=payload, key=self._private_key, algorithm=self.algorithm)
+        return token, expires_at - self.refresh_margin.total_seconds()
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from ecomm_common.tracing import traced
+from orders_service.idempotency import StoredResponse
+from repository.models import IdempotencyKeyModel
+
+
+class IdempotencyRepository:
+    def __init__(self, session):
+        self.session = session
+
+    @traced
+    def get(self, user_id: int, key: str) -> StoredResponse | None:
+        record = self.session.get(IdempotencyKeyModel, (user_id, key))
+        if record is None:
+            return None
+        if record.expires_at <= datetime.utcnow():
+            # Expired but not purged yet, the key can be used again
+            self.session.delete(record)
+            self.session.flush()
+            return None
+
+        return StoredResponse(
+            fingerprint=record.fingerprint,
+            status_code=record.status_code,
+            response=record.response,
+        )
+
+    @traced
+    def add(
+        self,
+        user_id: int,
+        key: str,
+        stored: StoredResponse,
+        ttl: timedelta,
+    ):
+        # Don't commit the session here, the response is committed along
+        # with the order it belongs to.
+        self.session.add(IdempotencyKeyModel(
+            user_id=user_id,
+            key=key,
+            fingerprint=stored.fingerprint,
+            status_code=stored.status_code,
+            response=stored.response,
+            expires_at=datetime.utcnow() + ttl,
+        ))
+
+    def purge_expired(self) -> int:
+        return self.session.execute(
+            sa.delete(IdempotencyKeyModel)
+            .where(IdempotencyKeyModel.expires_at <= datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
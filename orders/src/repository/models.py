@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
 import sqlalchemy.dialects.postgresql as pg
@@ -15,6 +15,10 @@ class Base(so.DeclarativeBase):
 
 class OrderModel(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Backs the keyset pagination of the orders of a user
+        sa.Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     user_id: so.Mapped[int]
@@ -23,7 +27,11 @@ class OrderModel(Base):
     created_at: so.Mapped[datetime] = so.mapped_column(default=datetime.utcnow)
     updated_at: so.Mapped[datetime] = so.mapped_column(default=datetime.utcnow)
 
-    items: so.Mapped[List["OrderItemModel"]] = relationship(back_populates="order")
+    # Ordered so that the items are split in the same batches every time
+    # they are booked or released
+    items: so.Mapped[List["OrderItemModel"]] = relationship(
+        back_populates="order", order_by="OrderItemModel.id",
+    )
 
     def dict(self):
         return {
@@ -43,7 +51,7 @@ class OrderItemModel(Base):
     __tablename__ = "order_items"
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
-    order_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('orders.id'))
+    order_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('orders.id'), index=True)
     order: so.Mapped["OrderModel"] = relationship(back_populates="items")
     product_id: so.Mapped[int]  # product_id from product service
     quantity: so.Mapped[int]
@@ -58,3 +66,48 @@ class OrderItemModel(Base):
     def __repr__(self):
         return f"<OrderItem id:{self.id} product_id:{self.product_id} " + \
         f"quantity: {self.quantity}>"
+
+
+class OutboxModel(Base):
+    __tablename__ = "order_outbox"
+    __table_args__ = (
+        # Used to find the events which are due
+        sa.Index("ix_order_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    order_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('orders.id'))
+    order: so.Mapped["OrderModel"] = relationship()
+    event_type: so.Mapped[str]
+    status: so.Mapped[str]
+    attempts: so.Mapped[int] = so.mapped_column(default=0)
+    next_attempt_at: so.Mapped[datetime] = so.mapped_column(default=datetime.utcnow)
+    # Set while a worker is processing the event
+    locked_until: so.Mapped[Optional[datetime]]
+    last_error: so.Mapped[Optional[str]]
+    created_at: so.Mapped[datetime] = so.mapped_column(default=datetime.utcnow)
+    processed_at: so.Mapped[Optional[datetime]]
+    # Trace of the request which wrote the event, the worker continues it
+    traceparent: so.Mapped[Optional[str]] = so.mapped_column(sa.String(55))
+
+    def __repr__(self):
+        return f"<Outbox id:{self.id} order_id:{self.order_id} " + \
+        f"event_type:{self.event_type} status:{self.status}>"
+
+
+class IdempotencyKeyModel(Base):
+    __tablename__ = "order_idempotency_keys"
+
+    # Keys are chosen by the clients, they are unique per user
+    user_id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    key: so.Mapped[str] = so.mapped_column(sa.String(255), primary_key=True)
+    # Hash of the request, a key can't be reused for another request
+    fingerprint: so.Mapped[str] = so.mapped_column(sa.String(64))
+    status_code: so.Mapped[int]
+    response: so.Mapped[dict] = so.mapped_column(sa.JSON)
+    created_at: so.Mapped[datetime] = so.mapped_column(default=datetime.utcnow)
+    expires_at: so.Mapped[datetime] = so.mapped_column(index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey user_id:{self.user_id} key:{self.key} " + \
+        f"expires_at:{self.expires_at}>"
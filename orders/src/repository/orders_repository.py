@@ -1,8 +1,12 @@
-from typing import List
+from datetime import datetime
+from itertools import groupby
+from typing import Iterator, List
 from orders_service.orders import Order, OrderItem, OrderStatus
 from repository.models import OrderModel, OrderItemModel
 from orders_service.exceptions import OrderNotFoundException
 import sqlalchemy as sa
+import sqlalchemy.orm as so
+from ecomm_common.tracing import traced
 
 # The repository layer should not expose internal dependencies to business layer.
 # Return Order entity instead of OrderModel which a DB model.
@@ -13,6 +17,7 @@ class OrdersRepository:
     def __init__(self, session):
         self.session = session
 
+    @traced
     def add(self, items: List[OrderItem], user_id: int) -> Order:
         order_items_for_db = [
             _OrderItem_to_OrderItemModel(item)
@@ -21,7 +26,8 @@ class OrdersRepository:
         order_model = OrderModel(
             items=order_items_for_db,
             user_id=user_id,
-            status=OrderStatus.CREATED.value,
+            # The products are booked after the order is committed
+            status=OrderStatus.PENDING.value,
         )
         self.session.add(order_model)
 
@@ -33,10 +39,12 @@ class OrdersRepository:
     def _get(self, id_, **filters):
         return (
             self.session.query(OrderModel)
+            .options(so.selectinload(OrderModel.items))
             .filter(OrderModel.id == str(id_))
             .filter_by(**filters)
         )
 
+    @traced
     def get_order(self, order_id, **filters):
         order_model = self._get(order_id, **filters).one_or_none()
         if not order_model:
@@ -45,10 +53,29 @@ class OrdersRepository:
         return _OrderModel_to_Order(order_model)
 
 
-    def list_orders(self, limit=None, **filters):
+    @traced
+    def list_orders(self, limit=None, after=None, **filters):
+        """Lists the orders newest first. `after` is the (created_at, id) of
+        the last order of the previous page.
+        """
         # query = self.session.query(OrderModel)
         # records = query.filter_by(**filters).limit(limit).all()
-        stmt = sa.select(OrderModel).filter_by(**filters).limit(limit)
+        # The items of all the orders are loaded with one more query instead
+        # of a query per order
+        stmt = (
+            sa.select(OrderModel)
+            .options(so.selectinload(OrderModel.items))
+            .filter_by(**filters)
+        )
+        if after is not None:
+            created_at, id_ = after
+            stmt = stmt.where(sa.or_(
+                OrderModel.created_at < created_at,
+                sa.and_(OrderModel.created_at == created_at, OrderModel.id < id_),
+            ))
+        stmt = stmt.order_by(
+            OrderModel.created_at.desc(), OrderModel.id.desc(),
+        ).limit(limit)
         orders = self.session.scalars(stmt).all()
 
         if not orders:
@@ -57,6 +84,62 @@ class OrdersRepository:
         return [_OrderModel_to_Order(ord) for ord in orders]
 
 
+    def iter_orders(self, chunk_size: int, **filters) -> Iterator[Order]:
+        """Yields the orders with their items in id order. The rows are
+        fetched `chunk_size` at a time from a server side cursor, only the
+        current chunk is held in memory.
+        """
+        stmt = (
+            sa.select(
+                OrderModel.id,
+                OrderModel.user_id,
+                OrderModel.status,
+                OrderModel.created_at,
+                OrderModel.updated_at,
+                OrderItemModel.id.label("item_id"),
+                OrderItemModel.product_id,
+                OrderItemModel.quantity,
+            )
+            .select_from(OrderModel)
+            # Before the join, filter_by applies to the last joined entity
+            .filter_by(**filters)
+            .outerjoin(OrderItemModel, OrderItemModel.order_id == OrderModel.id)
+            .order_by(OrderModel.id, OrderItemModel.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        rows = self.session.execute(stmt)
+        for _, order_rows in groupby(rows, key=lambda row: row.id):
+            order_rows = list(order_rows)
+            first = order_rows[0]
+            yield Order(
+                id=first.id,
+                status=OrderStatus(first.status),
+                items=[
+                    OrderItem(id=row.item_id, product_id=row.product_id, quantity=row.quantity)
+                    for row in order_rows
+                    if row.item_id is not None
+                ],
+                user_id=first.user_id,
+                created_at=first.created_at,
+                updated_at=first.updated_at,
+            )
+
+
+    @traced
+    def update_status(self, order_id, new_status: OrderStatus, **filters) -> bool:
+        """Updates the status of the order if it matches the filters, eg.
+        the current status. Returns False if no order was updated.
+        """
+        rows = self.session.execute(
+            sa.update(OrderModel)
+            .where(OrderModel.id == order_id)
+            .filter_by(**filters)
+            .values(status=new_status.value, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        return rows == 1
+
+
     def delete(self, id_):
         self.session.delete(self._get(id_))
 
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+from typing import List
+
+import sqlalchemy as sa
+
+from ecomm_common.tracing import current_traceparent, traced
+from orders_service.orders import Order, OrderStatus
+from orders_service.outbox import OutboxEvent, OutboxEventStatus, OutboxEventType
+from repository.models import OrderModel, OutboxModel
+
+
+class OutboxRepository:
+    def __init__(self, session):
+        self.session = session
+
+    def add(self, event_type: OutboxEventType, order: Order):
+        # Don't commit the session here, the event is committed along with
+        # the order.
+        self.session.add(OutboxModel(
+            order=order.order_,
+            event_type=event_type.value,
+            status=OutboxEventStatus.PENDING.value,
+            traceparent=current_traceparent(),
+        ))
+
+    @traced
+    def claim_due(self, limit: int, lease: timedelta) -> List[OutboxEvent]:
+        """Claims the pending events which are due for `lease`. An event
+        claimed by a worker is not claimed by the other workers till the
+        lease expires, so a crashed worker's events are picked up again.
+        """
+        now = datetime.utcnow()
+        not_locked = sa.or_(
+            OutboxModel.locked_until.is_(None),
+            OutboxModel.locked_until < now,
+        )
+        stmt = (
+            sa.select(OutboxModel)
+            .where(
+                OutboxModel.status == OutboxEventStatus.PENDING.value,
+                OutboxModel.next_attempt_at <= now,
+                not_locked,
+            )
+            .order_by(OutboxModel.next_attempt_at)
+            .limit(limit)
+        )
+
+        claimed = []
+        for event in self.session.scalars(stmt).all():
+            # Another worker may have claimed it since the select
+            rows = self.session.execute(
+                sa.update(OutboxModel)
+                .where(OutboxModel.id == event.id, not_locked)
+                .values(locked_until=now + lease)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if rows == 1:
+                claimed.append(_OutboxModel_to_OutboxEvent(event))
+
+        return claimed
+
+    def complete(self, event_id: int):
+        self._update(
+            event_id,
+            status=OutboxEventStatus.DONE.value,
+            processed_at=datetime.utcnow(),
+            locked_until=None,
+        )
+
+    def retry_later(self, event: OutboxEvent, error: str, delay: timedelta):
+        self._update(
+            event.id,
+            attempts=event.attempts + 1,
+            next_attempt_at=datetime.utcnow() + delay,
+            locked_until=None,
+            last_error=error,
+        )
+
+    def postpone(self, event: OutboxEvent, delay: timedelta):
+        self._update(
+            event.id,
+            next_attempt_at=datetime.utcnow() + delay,
+            locked_until=None,
+        )
+
+    def fail(self, event: OutboxEvent, error: str):
+        self._update(
+            event.id,
+            status=OutboxEventStatus.FAILED.value,
+            attempts=event.attempts + 1,
+            processed_at=datetime.utcnow(),
+            locked_until=None,
+            last_error=error,
+        )
+
+    def orders_without_event(
+        self,
+        event_type: OutboxEventType,
+        order_status: OrderStatus,
+        limit: int,
+    ) -> List[int]:
+        """Ids of the orders in `order_status` with no pending or processed
+        event of `event_type`, eg. cancelled orders whose release gave up.
+        """
+        has_event = sa.exists().where(
+            OutboxModel.order_id == OrderModel.id,
+            OutboxModel.event_type == event_type.value,
+            OutboxModel.status.in_([
+                OutboxEventStatus.PENDING.value, OutboxEventStatus.DONE.value,
+            ]),
+        )
+        return self.session.scalars(
+            sa.select(OrderModel.id)
+            .where(OrderModel.status == order_status.value, ~has_event)
+            .order_by(OrderModel.id)
+            .limit(limit)
+        ).all()
+
+    def _update(self, event_id: int, **values):
+        self.session.execute(
+            sa.update(OutboxModel)
+            .where(OutboxModel.id == event_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _OutboxModel_to_OutboxEvent(m: OutboxModel) -> OutboxEvent:
+    return OutboxEvent(
+        id=m.id,
+        order_id=m.order_id,
+        event_type=OutboxEventType(m.event_type),
+        attempts=m.attempts,
+        traceparent=m.traceparent,
+    )
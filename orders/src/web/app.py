@@ -1,34 +1,244 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import timedelta
 from functools import lru_cache
-from typing import Optional, Annotated, Dict
+from typing import Optional, Annotated, Dict, Literal
 import enum
-
-from fastapi import FastAPI, HTTPException, status
+import hashlib
+import json
+import logging
+
+from fastapi import APIRouter, FastAPI, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+import httpx
 import uvicorn
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
-from cryptography.x509 import load_pem_x509_certificate
 import jwt
 
 from config import AppConfig
-from orders_service.exceptions import OrderNotFoundException, ProductNotBookedException
+from ecomm_common.db_pool import create_engine, pool_stats
+from ecomm_common.internal import InternalAuth
+from ecomm_common.jwt_cache import VerifiedTokenCache
+from ecomm_common.keys import load_public_key
+from ecomm_common.metrics import CONTENT_TYPE, Metrics, MetricsMiddleware, instrument_engine
+from ecomm_common.sql_profiler import SqlProfiler, SqlProfilerMiddleware
+from ecomm_common.tracing import TracingMiddleware, create_exporter, trace_engine, traced, tracer
+from orders_service.exceptions import (
+    OrderNotFoundException,
+    OrderNotCancellableException,
+    ProductServiceCircuitOpenException,
+    ProductServiceUnavailableException,
+)
+from orders_service.idempotency import StoredResponse
 from orders_service.orders_service import OrdersService
 from orders_service.orders import Order, OrderItem
+from orders_service.outbox_worker import OutboxWorker
+from products_client.client import ProductsClient
+from products_client.resilience import BreakerState, CircuitBreaker, RetryBudget
+from products_client.service_token import ServiceTokenProvider
+from repository.idempotency_repository import IdempotencyRepository
 from repository.orders_repository import OrdersRepository
+from repository.outbox_repository import OutboxRepository
+from web.cursors import encode_cursor, decode_cursor
+from web.export import chunked, csv_lines, ndjson_lines
 from web.schemas import (
     GetOrderSchema,
     CreateOrderSchema,
     GetOrdersSchema,
 )
-from pathlib import Path
+PUBLIC_KEY = load_public_key(AppConfig().AUTH_JWT_PUBLIC_KEY_FILE)
+token_cache = VerifiedTokenCache(AppConfig().AUTH_JWT_CACHE_SIZE)
+# Configured in the lifespan, along with the engine
+sql_profiler = SqlProfiler()
+metrics = Metrics()
+products_latency = metrics.histogram(
+    "products_client_request_duration_seconds",
+    "Time of the calls to the products service, each retry counts",
+    ("path", "status"),
+)
+metrics.counter_func(
+    "jwt_cache_requests_total",
+    "Lookups of the verified tokens cache",
+    lambda: {("hits",): token_cache.hits, ("misses",): token_cache.misses},
+    ("result",),
+)
+
+
+def products_breaker() -> CircuitBreaker | None:
+    # Created by the lifespan, read on every scrape so that a restarted app
+    # reports its own breaker
+    client = getattr(app.state, "products_client", None)
+    return client.breaker if client else None
+
+
+def breaker_states():
+    breaker = products_breaker()
+    if breaker is None:
+        return {}
+    return {(state.value,): int(breaker.state == state) for state in BreakerState}
+
+
+def breaker_rejected():
+    breaker = products_breaker()
+    return {(): breaker.rejected} if breaker else {}
+
+
+metrics.gauge_func(
+    "products_client_breaker_state",
+    "State of the circuit breaker of the products service, 1 for the current one",
+    breaker_states,
+    ("state",),
+)
+metrics.counter_func(
+    "products_client_breaker_rejected_total",
+    "Calls to the products service rejected by the open circuit breaker",
+    breaker_rejected,
+)
+
+async def purge_idempotency_keys(Session, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(_purge_idempotency_keys, Session)
+        except Exception:
+            logging.exception("ERROR: Failed to purge the expired idempotency keys")
 
-public_key_text = Path(AppConfig().AUTH_JWT_PUBLIC_KEY_FILE).read_text()
-PUBLIC_KEY = load_pem_x509_certificate(public_key_text.encode()).public_key()
 
-app = FastAPI(debug=True)
+def _purge_idempotency_keys(Session):
+    with Session() as session:
+        IdempotencyRepository(session).purge_expired()
+        session.commit()
+
+
+async def reconcile_releases(Session, outbox_worker: OutboxWorker, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await run_in_threadpool(_reconcile_releases, Session):
+                outbox_worker.notify()
+        except Exception:
+            logging.exception("ERROR: Failed to reconcile the releases of the cancelled orders")
+
+
+def _reconcile_releases(Session, limit: int = 100) -> int:
+    with Session() as session:
+        scheduled = OrdersService(
+            OrdersRepository(session), outbox_repository=OutboxRepository(session),
+        ).reconcile_releases(limit)
+        session.commit()
+        if scheduled:
+            logging.warning(f"Scheduled the release of {scheduled} cancelled orders")
+        return scheduled
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    conf = get_config()
+    tracer.configure(
+        "orders",
+        conf.TRACING_SAMPLE_RATIO,
+        create_exporter(conf.TRACING_EXPORTER, conf.TRACING_FILE, conf.TRACING_MEMORY_SPANS),
+    )
+
+    app.state.engine = create_engine(
+        conf.ORDERS_DB_URL,
+        echo=conf.ORDERS_DB_ECHO,
+        pool_size=conf.ORDERS_DB_POOL_SIZE,
+        max_overflow=conf.ORDERS_DB_MAX_OVERFLOW,
+        pool_pre_ping=conf.ORDERS_DB_POOL_PRE_PING,
+        pool_recycle=conf.ORDERS_DB_POOL_RECYCLE,
+    )
+    app.state.Session = so.sessionmaker(bind=app.state.engine)
+    instrument_engine(app.state.engine, metrics)
+    trace_engine(app.state.engine)
+    sql_profiler.configure(
+        sample_ratio=conf.ORDERS_DB_PROFILE_SAMPLE_RATIO,
+        slow_query_seconds=conf.ORDERS_DB_SLOW_QUERY_SECONDS,
+        explain=conf.ORDERS_DB_EXPLAIN_SLOW_QUERIES,
+    )
+    sql_profiler.instrument(app.state.engine)
+
+    # A single http client per process so that the connections to the
+    # products service are reused across orders.
+    http_client = httpx.AsyncClient(
+        base_url=f"{conf.PRODUCT_SRV_HOST}:{conf.PRODUCT_SRV_PORT}",
+        limits=httpx.Limits(
+            max_connections=conf.PRODUCT_SRV_MAX_CONNECTIONS,
+            max_keepalive_connections=conf.PRODUCT_SRV_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=conf.PRODUCT_SRV_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=conf.PRODUCT_SRV_CONNECT_TIMEOUT,
+            read=conf.PRODUCT_SRV_READ_TIMEOUT,
+            write=conf.PRODUCT_SRV_WRITE_TIMEOUT,
+            pool=conf.PRODUCT_SRV_POOL_TIMEOUT,
+        ),
+    )
+    app.state.products_client = ProductsClient(
+        http_client,
+        token_provider=ServiceTokenProvider(
+            conf.AUTH_JWT_PRIVATE_KEY_FILE,
+            algorithm=conf.AUTH_JWT_ALGORITHM,
+            ttl=timedelta(seconds=conf.PRODUCT_SRV_TOKEN_TTL_SECONDS),
+            refresh_margin=timedelta(seconds=conf.PRODUCT_SRV_TOKEN_REFRESH_MARGIN_SECONDS),
+        ),
+        batch_size=conf.PRODUCT_SRV_BOOKING_BATCH_SIZE,
+        max_concurrency=conf.PRODUCT_SRV_BOOKING_CONCURRENCY,
+        max_retries=conf.PRODUCT_SRV_MAX_RETRIES,
+        retry_backoff=conf.PRODUCT_SRV_RETRY_BACKOFF_SECONDS,
+        retry_backoff_max=conf.PRODUCT_SRV_RETRY_BACKOFF_MAX_SECONDS,
+        retry_budget=RetryBudget(
+            ratio=conf.PRODUCT_SRV_RETRY_BUDGET_RATIO,
+            min_per_second=conf.PRODUCT_SRV_RETRY_BUDGET_MIN_PER_SECOND,
+        ),
+        breaker=CircuitBreaker(
+            failure_threshold=conf.PRODUCT_SRV_BREAKER_FAILURE_THRESHOLD,
+            reset_timeout=conf.PRODUCT_SRV_BREAKER_RESET_TIMEOUT_SECONDS,
+        ),
+        latency=products_latency,
+    )
+    app.state.outbox_worker = OutboxWorker(
+        app.state.Session,
+        app.state.products_client,
+        batch_size=conf.ORDERS_OUTBOX_BATCH_SIZE,
+        concurrency=conf.ORDERS_OUTBOX_CONCURRENCY,
+        poll_interval=conf.ORDERS_OUTBOX_POLL_INTERVAL_SECONDS,
+        lease=timedelta(seconds=conf.ORDERS_OUTBOX_LEASE_SECONDS),
+        max_attempts=conf.ORDERS_OUTBOX_MAX_ATTEMPTS,
+        retry_backoff=conf.ORDERS_OUTBOX_RETRY_BACKOFF_SECONDS,
+    )
+    outbox_task = asyncio.create_task(app.state.outbox_worker.run())
+    purge_task = asyncio.create_task(purge_idempotency_keys(
+        app.state.Session, conf.ORDERS_IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+    ))
+    reconcile_task = asyncio.create_task(reconcile_releases(
+        app.state.Session,
+        app.state.outbox_worker,
+        conf.ORDERS_RELEASE_RECONCILE_INTERVAL_SECONDS,
+    ))
+    yield
+    for task in (outbox_task, purge_task, reconcile_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await http_client.aclose()
+    app.state.engine.dispose()
+
+
+app = FastAPI(debug=True, lifespan=lifespan, default_response_class=ORJSONResponse)
+# /internal/* and /metrics, included once their routes are defined
+internal = APIRouter(
+    tags=["Internal"], dependencies=[Depends(InternalAuth(AppConfig().INTERNAL_API_TOKEN))],
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,28 +247,47 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware, tracer=tracer)
+app.add_middleware(SqlProfilerMiddleware, profiler=sql_profiler)
+# Added last so that it is the outermost middleware and times the others too
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 bearer_auth = HTTPBearer()
 
+
+@app.exception_handler(ProductServiceUnavailableException)
+async def product_service_unavailable(request: Request, exc: ProductServiceUnavailableException):
+    headers = {}
+    if isinstance(exc, ProductServiceCircuitOpenException):
+        headers["Retry-After"] = str(max(1, round(exc.retry_after)))
+    return ORJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Product service is unavailable"},
+        headers=headers,
+    )
+
 class UserRole(enum.Enum):
     SELLER = "SELLER"
     BUYER = "BUYER"
     ORDER_SRV = "ORDER_SRV"
+    # Back-office, can export the orders of all the users
+    ADMIN = "ADMIN"
 
 @lru_cache
 def get_config() -> AppConfig:
     return AppConfig()
 
 
-def get_session(conf: Annotated[AppConfig, Depends(get_config)]):
-    # engine = sa.create_engine("sqlite:///orders.db", echo=True)
-    engine = sa.create_engine(conf.ORDERS_DB_URL, echo=True)
-    s = so.Session(engine)
+def get_session(request: Request):
+    s = request.app.state.Session()
     try:
         yield s 
     finally:
         s.close()
 
+def get_outbox_worker(request: Request) -> OutboxWorker:
+    return request.app.state.outbox_worker
+
 def get_jwt_payload(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(bearer_auth)]
 ) -> Dict:
@@ -75,17 +304,20 @@ def get_jwt_payload(
     )
 
     try:
-        payload = jwt.decode(
-            token,
-            key=PUBLIC_KEY,
-            algorithms=['RS256'],
-        )
+        payload = token_cache.decode(token, verify_token)
 
         return payload
 
     except jwt.InvalidTokenError as e:
         raise credentials_exception
 
+def verify_token(token: str) -> Dict:
+    return jwt.decode(
+        token,
+        key=PUBLIC_KEY,
+        algorithms=[get_config().AUTH_JWT_ALGORITHM],
+    )
+
 def get_current_user(jwt_payload: Annotated[Dict, Depends(get_jwt_payload)]) -> int:
     user_id = jwt_payload.get("user_id")
     if user_id is None:
@@ -97,14 +329,24 @@ def get_current_user(jwt_payload: Annotated[Dict, Depends(get_jwt_payload)]) ->
 
     return int(user_id)
 
-def get_user_role(jwt_payload: Annotated[Dict, Depends(get_jwt_payload)]) -> UserRole | None:
-    role = jwt_payload.get('role')
-    if not role:
+def get_user_role(
+    jwt_payload: Annotated[Dict, Depends(get_jwt_payload)],
+    conf: Annotated[AppConfig, Depends(get_config)],
+) -> UserRole:
+    """Role of the caller. The users service puts the role of the user in
+    the `user_role` claim, in lowercase. The back-office tokens are admins.
+    """
+    if jwt_payload.get("iss") == conf.ORDERS_ADMIN_TOKEN_ISSUER:
+        return UserRole.ADMIN
+
+    role = str(jwt_payload.get("user_role") or "").upper()
+    # The users service only has buyers and sellers
+    if role not in (UserRole.BUYER.value, UserRole.SELLER.value):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Role is mandatory",
+            detail="Invalid role",
             headers={"WWW-Authenticate": "Bearer"},
-        ) 
+        )
     return UserRole(role)
 
 @app.get(
@@ -115,16 +357,44 @@ def get_user_role(jwt_payload: Annotated[Dict, Depends(get_jwt_payload)]) -> Use
 def get_orders(
     session: Annotated[so.Session, Depends(get_session)],
     user_id: Annotated[int, Depends(get_current_user)],
+    conf: Annotated[AppConfig, Depends(get_config)],
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+    after: Optional[str] = None,
 ):
+    """Lists the orders of the user, newest first. The orders are paginated,
+    pass the `next_cursor` of the response as `after` to get the next page.
+    """
+    limit = min(limit or conf.ORDERS_PAGE_SIZE, conf.ORDERS_MAX_PAGE_SIZE)
+    try:
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor",
+        )
+
     repo = OrdersRepository(session)
     orders_service = OrdersService(repo)
     try:
-        results = orders_service.list_orders(user_id=user_id)
+        # Fetch one extra order to know if there is a next page
+        results = orders_service.list_orders(
+            user_id=user_id, limit=limit + 1, after=after_key,
+        )
     except OrderNotFoundException:
         # return an empty list
-        return {"orders": []}
+        return ORJSONResponse({"orders": [], "next_cursor": None})
 
-    return {"orders": [result.dict() for result in results]}
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1].created_at, results[-1].id)
+
+    # The orders of the repository match GetOrdersSchema. Returned as a
+    # response they are serialised by orjson as they are, FastAPI validates
+    # only the content it serialises itself. response_model documents the API.
+    return ORJSONResponse({
+        "orders": [result.dict() for result in results],
+        "next_cursor": next_cursor,
+    })
 
 
 @app.post(
@@ -133,28 +403,148 @@ def get_orders(
     response_model=GetOrderSchema,
     tags=["Order"],
 )
-def create_order(
+async def create_order(
     payload: CreateOrderSchema,
     session: Annotated[so.Session, Depends(get_session)],
     user_id: Annotated[int, Depends(get_current_user)],
-
+    outbox_worker: Annotated[OutboxWorker, Depends(get_outbox_worker)],
+    conf: Annotated[AppConfig, Depends(get_config)],
+    idempotency_key: Annotated[
+        Optional[str], Header(min_length=1, max_length=255)
+    ] = None,
 ):
+    """Places the order in PENDING state. The products are booked in the
+    background, the order moves to CREATED once they are booked or to
+    CANCELLED if none of them could be.
+
+    Send an `Idempotency-Key` header to retry safely. A retry with the same
+    key and payload gets the response of the first request, without placing
+    another order.
+    """
+    fingerprint = _fingerprint(payload)
+    idempotency = IdempotencyRepository(session)
+    if idempotency_key:
+        stored = await run_in_threadpool(idempotency.get, user_id, idempotency_key)
+        if stored:
+            return _replay(stored, fingerprint)
+
     repo = OrdersRepository(session)
-    orders_service = OrdersService(repo)
+    orders_service = OrdersService(repo, outbox_repository=OutboxRepository(session))
     items_json = payload.dict()["items"]
 
     items = [OrderItem(**item) for item in items_json]
 
-    try:
-        order = orders_service.place_order(items, user_id)
+    order = orders_service.place_order(items, user_id)
+
+    # The DB calls are blocking, keep them off the event loop
+    result = await run_in_threadpool(
+        _commit_order,
+        session,
+        order,
+        idempotency,
+        idempotency_key,
+        fingerprint,
+        timedelta(seconds=conf.ORDERS_IDEMPOTENCY_KEY_TTL_SECONDS),
+    )
+    if isinstance(result, StoredResponse):
+        # A concurrent request with the same key placed the order
+        return _replay(result, fingerprint)
+
+    outbox_worker.notify()
+
+    return ORJSONResponse(result, status_code=status.HTTP_201_CREATED)
+
+
+@traced
+def _commit_order(
+    session: so.Session,
+    order: Order,
+    idempotency: IdempotencyRepository,
+    idempotency_key: str | None,
+    fingerprint: str,
+    ttl: timedelta,
+) -> Dict | StoredResponse:
+    if not idempotency_key:
         session.commit()
         return order.dict()
 
-    except ProductNotBookedException:
-        # rollback any changes made to the DB
+    # Flush to get the id and created_at of the order for the response
+    session.flush()
+    response = jsonable_encoder(order.dict())
+    # The response is stored in the same transaction as the order, there is
+    # no window where one exists without the other.
+    idempotency.add(
+        order.user_id,
+        idempotency_key,
+        StoredResponse(fingerprint, status.HTTP_201_CREATED, response),
+        ttl,
+    )
+    try:
+        session.commit()
+    except sa.exc.IntegrityError:
         session.rollback()
-        # reraise the exception
-        raise ProductNotBookedException()
+        return idempotency.get(order.user_id, idempotency_key)
+
+    return response
+
+
+def _fingerprint(payload: CreateOrderSchema) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(stored: StoredResponse, fingerprint: str) -> ORJSONResponse:
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was used for a different request",
+        )
+    return ORJSONResponse(
+        status_code=stored.status_code,
+        content=stored.response,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+@app.get(
+    "/orders/export",
+    tags=["Order"],
+    responses={
+        200: {"content": {"application/x-ndjson": {}, "text/csv": {}}},
+    },
+)
+def export_orders(
+    request: Request,
+    user_id: Annotated[int, Depends(get_current_user)],
+    role: Annotated[UserRole, Depends(get_user_role)],
+    conf: Annotated[AppConfig, Depends(get_config)],
+    format: Literal["ndjson", "csv"] = "ndjson",
+):
+    """Streams the orders of the user with their items, oldest first, as
+    NDJSON (one order per line) or CSV (one item per line). Admins get the
+    orders of all the users.
+    """
+    filters = {} if role == UserRole.ADMIN else {"user_id": user_id}
+    lines = ndjson_lines if format == "ndjson" else csv_lines
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+
+    return StreamingResponse(
+        chunked(lines(_export_orders(
+            request.app.state.Session, conf.ORDERS_EXPORT_CHUNK_SIZE, filters,
+        ))),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'},
+    )
+
+
+def _export_orders(Session, chunk_size: int, filters: Dict):
+    # The session of the request is closed before the response is streamed,
+    # the export reads through its own. The response iterates it in a worker
+    # thread.
+    with Session() as session:
+        yield from OrdersService(OrdersRepository(session)).export_orders(
+            chunk_size, **filters,
+        )
 
 
 @app.get(
@@ -174,11 +564,99 @@ def get_order(
         order = orders_service.get_order(
             order_id=order_id, user_id=user_id,
         )
-        return order.dict()
+        return ORJSONResponse(order.dict())
+    except OrderNotFoundException:
+        raise HTTPException(
+            status_code=404, detail=f"Order with ID {order_id} not found"
+        )
+
+@app.post(
+    "/orders/{order_id}/cancel",
+    response_model=GetOrderSchema,
+    tags=["Order"],
+)
+async def cancel_order(
+    order_id: int,
+    session: Annotated[so.Session, Depends(get_session)],
+    user_id: Annotated[int, Depends(get_current_user)],
+    outbox_worker: Annotated[OutboxWorker, Depends(get_outbox_worker)],
+):
+    """Cancels a PENDING or CREATED order. The stock booked for the order is
+    given back in the background.
+    """
+    orders_service = OrdersService(
+        OrdersRepository(session), outbox_repository=OutboxRepository(session),
+    )
+
+    try:
+        order = await run_in_threadpool(
+            _cancel_order, session, orders_service, order_id, user_id,
+        )
     except OrderNotFoundException:
         raise HTTPException(
             status_code=404, detail=f"Order with ID {order_id} not found"
         )
+    except OrderNotCancellableException as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    outbox_worker.notify()
+    return ORJSONResponse(order)
+
+
+def _cancel_order(
+    session: so.Session, orders_service: OrdersService, order_id: int, user_id: int,
+) -> Dict:
+    order = orders_service.cancel_order(order_id, user_id=user_id)
+    session.commit()
+    return order.dict()
+
+
+@internal.get("/internal/db_pool")
+def get_db_pool_stats(
+    request: Request,
+    conf: Annotated[AppConfig, Depends(get_config)],
+):
+    """Connection pool usage of this process. Used to size the pool against
+    the max_connections of the DB.
+    """
+    return {
+        **pool_stats(request.app.state.engine),
+        "max_size": conf.ORDERS_DB_POOL_SIZE + conf.ORDERS_DB_MAX_OVERFLOW,
+    }
+
+@internal.get("/internal/products_client")
+def get_products_client_stats(request: Request):
+    """State of the circuit breaker and the retry budget of the calls to the
+    products service.
+    """
+    return request.app.state.products_client.stats()
+
+@internal.get("/internal/jwt_cache")
+def get_jwt_cache_stats():
+    return token_cache.stats()
+
+@internal.get("/internal/traces")
+def get_traces(trace_id: Optional[str] = None):
+    """Spans kept in memory by this process, the latest last. Empty with the
+    file exporter.
+    """
+    return tracer.exporter.spans(trace_id)
+
+@internal.get("/internal/sql_profile")
+def get_sql_profile(limit: Annotated[int, Query(ge=1)] = 20):
+    """The statements which took the most DB time and the queries per
+    route, over the sampled requests
+    """
+    return sql_profiler.report(limit)
+
+@internal.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Metrics of this process in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+app.include_router(internal)
+
 
 if __name__ == '__main__':
         uvicorn.run("web.app:app", host="0.0.0.0", port=8003, reload=True)
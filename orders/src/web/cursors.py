@@ -0,0 +1,20 @@
+import base64
+import json
+from datetime import datetime
+
+
+# Cursors are opaque to the clients. They hold the sort key of the last order
+# of a page, ie. (created_at, id), and the next page starts after it.
+
+def encode_cursor(created_at: datetime, id_: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id_]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Raises ValueError if the cursor is invalid"""
+    try:
+        created_at, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(id_)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
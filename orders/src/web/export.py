@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+from orders_service.orders import Order
+
+# Encoders of GET /orders/export. The orders are encoded as they are read,
+# the lines are sent in chunks of about CHUNK_BYTES to keep the number of
+# writes to the socket down.
+
+CHUNK_BYTES = 64 * 1024
+
+CSV_HEADER = [
+    "order_id", "user_id", "status", "created_at", "updated_at",
+    "item_id", "product_id", "quantity",
+]
+
+
+def ndjson_lines(orders: Iterable[Order]) -> Iterator[str]:
+    """One line per order, with its items"""
+    for order in orders:
+        yield json.dumps({
+            "id": order.id,
+            "user_id": order.user_id,
+            "status": order.status.value,
+            "created_at": order.created_at.isoformat(),
+            "updated_at": order.updated_at.isoformat(),
+            "items": [
+                {"id": item.id, "product_id": item.product_id, "quantity": item.quantity}
+                for item in order.items
+            ],
+        }) + "\n"
+
+
+def csv_lines(orders: Iterable[Order]) -> Iterator[str]:
+    """A header, then one line per item. An order without items gets a line
+    with empty item columns.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    # Sent even if there are no orders
+    writer.writerow(CSV_HEADER)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for order in orders:
+        columns = [
+            order.id, order.user_id, order.status.value,
+            order.created_at.isoformat(), order.updated_at.isoformat(),
+        ]
+        for item in order.items or [None]:
+            if item is None:
+                writer.writerow(columns + ["", "", ""])
+            else:
+                writer.writerow(columns + [item.id, item.product_id, item.quantity])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def chunked(lines: Iterable[str], size: int = CHUNK_BYTES) -> Iterator[bytes]:
+    chunk = []
+    length = 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(chunk).encode()
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk).encode()
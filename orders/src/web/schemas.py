@@ -41,4 +41,6 @@ class GetOrderSchema(CreateOrderSchema):
 
 class GetOrdersSchema(BaseModel):
     orders: List[GetOrderSchema]
+    # Pass as `after` to get the next page, None on the last page
+    next_cursor: Optional[str] = None
     model_config = ConfigDict(extra="forbid")
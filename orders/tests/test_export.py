@@ -0,0 +1,107 @@
+"""GET /orders/export with tokens minted like the ones of the users service"""
+import csv
+import importlib.util
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+import sqlalchemy.orm as so
+from fastapi.testclient import TestClient
+
+from config import AppConfig
+from orders_service.orders import OrderItem
+from repository.models import Base
+from repository.orders_repository import OrdersRepository
+from web.app import app
+from web.export import CSV_HEADER
+
+USERS_SERVICE = Path(__file__).resolve().parents[2] / "users"
+
+
+def load_signer():
+    """JWTSigner of the users service, with its private key"""
+    spec = importlib.util.spec_from_file_location(
+        "users_auth", USERS_SERVICE / "src" / "auth.py",
+    )
+    auth = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(auth)
+    return auth.JWTSigner(str(USERS_SERVICE / "private_key.pem"))
+
+
+SIGNER = load_signer()
+
+
+def headers(**claims) -> dict:
+    claims["exp"] = datetime.now(timezone.utc) + timedelta(minutes=15)
+    return {"Authorization": f"Bearer {SIGNER.sign(claims)}"}
+
+
+def user_token(user_id: int, role: str) -> dict:
+    # The claims of POST /users/token of the users service
+    return headers(
+        iss="user_srv", user_id=user_id, username=f"user-{user_id}", user_role=role,
+    )
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        engine = app.state.engine
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        with so.Session(engine) as session:
+            repo = OrdersRepository(session)
+            repo.add([OrderItem(product_id=1, quantity=2)], user_id=1)
+            repo.add([OrderItem(product_id=2, quantity=1)], user_id=2)
+            session.commit()
+        yield client
+
+
+def export(client, headers, format="ndjson"):
+    return client.get("/orders/export", params={"format": format}, headers=headers)
+
+
+@pytest.mark.parametrize("role", ["buyer", "seller"])
+def test_users_export_their_orders(client, role):
+    response = export(client, user_token(1, role))
+
+    assert response.status_code == 200
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    assert [order["user_id"] for order in orders] == [1]
+
+
+def test_backoffice_exports_all_orders(client):
+    response = export(
+        client, headers(iss=AppConfig().ORDERS_ADMIN_TOKEN_ISSUER, user_id=99),
+    )
+
+    assert response.status_code == 200
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    assert [order["user_id"] for order in orders] == [1, 2]
+
+
+@pytest.mark.parametrize("role", [None, "admin", "order_srv", "nobody"])
+def test_invalid_roles_are_rejected(client, role):
+    claims = {"iss": "user_srv", "user_id": 1, "username": "user-1"}
+    if role is not None:
+        claims["user_role"] = role
+
+    assert export(client, headers(**claims)).status_code == 401
+
+
+def test_csv_export(client):
+    response = export(client, user_token(1, "buyer"), format="csv")
+
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == CSV_HEADER
+    assert [row[:3] + row[6:] for row in rows[1:]] == [["1", "1", "PENDING", "1", "2"]]
+
+
+def test_csv_export_without_orders_has_a_header(client):
+    response = export(client, user_token(3, "buyer"), format="csv")
+
+    assert response.status_code == 200
+    assert response.text == ",".join(CSV_HEADER) + "\n"
@@ -0,0 +1,42 @@
+"""/internal/* and /metrics are only served to the holders of the token"""
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from config import AppConfig
+from ecomm_common.internal import InternalAuth
+from web.app import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.mark.parametrize("path", [
+    "/internal/db_pool",
+    "/internal/jwt_cache",
+    "/internal/products_client",
+    "/metrics",
+    "/internal/traces",
+    "/internal/sql_profile",
+])
+def test_served_with_the_token(client, path):
+    token = AppConfig().INTERNAL_API_TOKEN
+    response = client.get(path, headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer wrong"}, {"Authorization": "Basic internal-token"}])
+def test_rejected_without_the_token(client, headers):
+    assert client.get("/internal/db_pool", headers=headers).status_code == 401
+    assert client.get("/metrics", headers=headers).status_code == 401
+
+
+def test_not_served_without_a_configured_token():
+    with pytest.raises(HTTPException) as e:
+        InternalAuth(None)(authorization="Bearer anything")
+
+    assert e.value.status_code == 404
@@ -0,0 +1,29 @@
+"""/metrics of an app started more than once in the process, like by every
+TestClient or a reload"""
+from collections import Counter
+
+from fastapi.testclient import TestClient
+
+from config import AppConfig
+from web.app import app
+
+HEADERS = {"Authorization": f"Bearer {AppConfig().INTERNAL_API_TOKEN}"}
+
+
+def scrape() -> str:
+    with TestClient(app) as client:
+        response = client.get("/metrics", headers=HEADERS)
+        assert response.status_code == 200
+        return response.text
+
+
+def test_metric_families_are_registered_once():
+    scrape()
+    text = scrape()
+
+    families = Counter(line.split()[2] for line in text.splitlines() if line.startswith("# TYPE"))
+    assert families["products_client_breaker_state"] == 1
+    assert families["db_pool_connections"] == 1
+    assert families["db_query_duration_seconds"] == 1
+    assert [name for name, count in families.items() if count > 1] == []
+    assert 'products_client_breaker_state{state="CLOSED"} 1' in text
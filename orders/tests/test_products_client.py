@@ -0,0 +1,91 @@
+"""The products client retries the transient failures only, the calls the
+products service rejects fail the outbox event without cancelling the order"""
+import asyncio
+
+import httpx
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from config import AppConfig
+from orders_service.exceptions import ProductServiceRejectedException
+from orders_service.orders import OrderItem, OrderStatus
+from orders_service.orders_service import OrdersService
+from orders_service.outbox import OutboxEventStatus
+from orders_service.outbox_worker import OutboxWorker
+from orders_service.ports import ProductsPort
+from products_client.client import ProductsClient
+from products_client.resilience import BreakerState
+from products_client.service_token import ServiceTokenProvider
+from repository.models import Base, OrderModel, OutboxModel
+from repository.orders_repository import OrdersRepository
+from repository.outbox_repository import OutboxRepository
+
+ITEMS = [OrderItem(product_id=1, quantity=1)]
+
+
+def make_client(*statuses: int):
+    """Client of a products service answering the calls with `statuses`"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(statuses[len(calls) - 1], json={"items": []})
+
+    client = ProductsClient(
+        httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://products"),
+        ServiceTokenProvider(AppConfig().AUTH_JWT_PRIVATE_KEY_FILE),
+        retry_backoff=0,
+    )
+    return client, calls
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 403, 404, 422])
+def test_rejected_calls_are_not_retried(status_code):
+    client, calls = make_client(status_code, 200)
+
+    with pytest.raises(ProductServiceRejectedException) as e:
+        asyncio.run(client.release(ITEMS, "order-1"))
+
+    assert e.value.status_code == status_code
+    assert len(calls) == 1
+    # The service is up
+    assert client.breaker.state == BreakerState.CLOSED
+
+
+def test_conflicting_release_is_retried():
+    client, calls = make_client(409, 200)
+
+    asyncio.run(client.release(ITEMS, "order-1"))
+
+    assert len(calls) == 2
+
+
+class RejectingProducts(ProductsPort):
+
+    async def book(self, items, reservation_id):
+        raise ProductServiceRejectedException(401, "Invalid token")
+
+    async def release(self, items, reservation_id):
+        raise ProductServiceRejectedException(401, "Invalid token")
+
+
+def test_rejected_booking_doesnt_cancel_the_order(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/orders.db")
+    Base.metadata.create_all(engine)
+    Session = so.sessionmaker(bind=engine)
+    with Session() as session:
+        OrdersService(
+            OrdersRepository(session), outbox_repository=OutboxRepository(session),
+        ).place_order(ITEMS, user_id=1)
+        session.commit()
+
+    worker = OutboxWorker(Session, RejectingProducts(), max_attempts=1)
+    assert asyncio.run(worker.process_due()) == 1
+
+    with Session() as session:
+        order = session.scalars(sa.select(OrderModel)).one()
+        assert order.status == OrderStatus.PENDING
+        event = session.scalars(sa.select(OutboxModel)).one()
+        assert event.status == OutboxEventStatus.FAILED.value
+        assert "Invalid token" in event.last_error
@@ -1,29 +1,95 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from datetime import datetime
 import enum
-from pathlib import Path
-from typing import Annotated
+import logging
+from typing import Annotated, Optional
 import uvicorn
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
-from cryptography.x509 import load_pem_x509_certificate
-from db import Product, ProductStatus
+from db import Product, ProductStatus, Reservation, ReservationStatus
 import jwt
 from jwt.exceptions import InvalidTokenError
-from schemas import CreateProductSchema, GetProductSchema, UpdateProductSchema
+from schemas import (
+    CreateProductSchema, GetProductSchema, GetProductsSchema, ListProductSchema,
+    SearchProductsSchema, UpdateProductSchema, BulkImportResultSchema,
+    BuyProductsSchema, BuyProductsResultSchema, BuyProductItemResultSchema,
+    ReleaseProductsSchema, ReleaseProductsResultSchema, ReleaseResultSchema,
+)
+from bulk_import import (
+    BulkImport, CSV_CONTENT_TYPES, NDJSON_CONTENT_TYPES, csv_rows, ndjson_rows, read_lines,
+)
+from cache import ReadThroughCache
 from config import AppConfig
+from cursors import decode_cursor, encode_cursor
+from ecomm_common.internal import InternalAuth
+from ecomm_common.jwt_cache import VerifiedTokenCache
+from ecomm_common.keys import load_public_key
+from ecomm_common.metrics import CONTENT_TYPE, Metrics, MetricsMiddleware, instrument_engine
+from ecomm_common.sql_profiler import SqlProfiler, SqlProfilerMiddleware
+from ecomm_common.tracing import TracingMiddleware, create_exporter, trace_engine, tracer
+from hot_inventory import HotSkuInventory
+from inventory import release_stock, reserve_stock
+from search import ensure_search_index, search_products
 
 conf = AppConfig()
-public_key_text = Path(conf.AUTH_JWT_PUBLIC_KEY_FILE).read_text()
-PUBLIC_KEY = load_pem_x509_certificate(public_key_text.encode()).public_key()
+PUBLIC_KEY = load_public_key(conf.AUTH_JWT_PUBLIC_KEY_FILE)
+token_cache = VerifiedTokenCache(conf.AUTH_JWT_CACHE_SIZE)
+hot_skus = HotSkuInventory(conf.HOT_SKU_PRODUCT_IDS, shards=conf.HOT_SKU_SHARDS)
+# Catalog reads outnumber the writes by far. The products are cached by id
+# and the pages of the listing by their query.
+product_cache = ReadThroughCache(conf.PRODUCTS_CACHE_TTL_SECONDS, conf.PRODUCTS_CACHE_SIZE)
+listing_cache = ReadThroughCache(conf.PRODUCTS_CACHE_TTL_SECONDS, conf.PRODUCTS_LIST_CACHE_SIZE)
+tracer.configure(
+    "products",
+    conf.TRACING_SAMPLE_RATIO,
+    create_exporter(conf.TRACING_EXPORTER, conf.TRACING_FILE, conf.TRACING_MEMORY_SPANS),
+)
 
-app = FastAPI(debug=True)
+
+async def reconcile_hot_skus():
+    while True:
+        await asyncio.sleep(conf.HOT_SKU_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(hot_skus.reconcile_all, Session)
+        except Exception:
+            logging.exception("ERROR: Failed to reconcile the stock of hot products")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ensure_search_index(engine)
+    with Session() as session:
+        hot_skus.sync(session)
+
+    reconciler = None
+    if hot_skus.product_ids:
+        reconciler = asyncio.create_task(reconcile_hot_skus())
+    yield
+    if reconciler:
+        reconciler.cancel()
+        # Leave the products table up to date
+        try:
+            await run_in_threadpool(hot_skus.reconcile_all, Session)
+        except Exception:
+            logging.exception("ERROR: Failed to reconcile the stock of hot products")
+
+
+app = FastAPI(debug=True, lifespan=lifespan, default_response_class=ORJSONResponse)
+# /internal/* and /metrics, included once their routes are defined
+internal = APIRouter(
+    tags=["Internal"], dependencies=[Depends(InternalAuth(conf.INTERNAL_API_TOKEN))],
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,10 +99,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-engine = sa.create_engine(conf.PRODUCTS_DB_URL, echo=True)
+app.add_middleware(TracingMiddleware, tracer=tracer)
+sql_profiler = SqlProfiler(
+    sample_ratio=conf.PRODUCTS_DB_PROFILE_SAMPLE_RATIO,
+    slow_query_seconds=conf.PRODUCTS_DB_SLOW_QUERY_SECONDS,
+    explain=conf.PRODUCTS_DB_EXPLAIN_SLOW_QUERIES,
+)
+app.add_middleware(SqlProfilerMiddleware, profiler=sql_profiler)
+metrics = Metrics()
+# Added last so that it is the outermost middleware and times the others too
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+engine = sa.create_engine(conf.PRODUCTS_DB_URL, echo=conf.PRODUCTS_DB_ECHO)
 Session = so.sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine, metrics)
+trace_engine(engine)
+sql_profiler.instrument(engine)
+
+
+def cache_requests():
+    counts = {}
+    for name, cache in (("products", product_cache), ("listing", listing_cache)):
+        stats = cache.stats()
+        for result in ("hits", "misses", "coalesced"):
+            counts[(name, result)] = stats[result]
+    return counts
+
+
+metrics.counter_func(
+    "product_cache_requests_total",
+    "Lookups of the product and listing caches",
+    cache_requests,
+    ("cache", "result"),
+)
+metrics.counter_func(
+    "jwt_cache_requests_total",
+    "Lookups of the verified tokens cache",
+    lambda: {("hits",): token_cache.hits, ("misses",): token_cache.misses},
+    ("result",),
+)
 
 bearer_auth = HTTPBearer()
+optional_bearer_auth = HTTPBearer(auto_error=False)
     
 def get_session():
     s = Session()
@@ -80,11 +184,7 @@ def get_jwt_payload(
     )
 
     try:
-        payload = jwt.decode(
-            token,
-            key=PUBLIC_KEY,
-            algorithms=['RS256'],
-        )
+        payload = token_cache.decode(token, verify_token)
 
         return JWTPayload(
             iss = payload.get('iss'),
@@ -96,6 +196,23 @@ def get_jwt_payload(
     except InvalidTokenError as e:
         raise credentials_exception
 
+def verify_token(token: str) -> dict:
+    return jwt.decode(
+        token,
+        key=PUBLIC_KEY,
+        algorithms=[conf.AUTH_JWT_ALGORITHM],
+    )
+
+def get_optional_user(
+    credentials: Annotated[
+        Optional[HTTPAuthorizationCredentials], Depends(optional_bearer_auth)
+    ],
+) -> int | None:
+    """Id of the user for the endpoints which work without a token too"""
+    if credentials is None:
+        return None
+    return get_current_user(get_jwt_payload(credentials))
+
 def get_current_user(jwt_payload: Annotated[JWTPayload, Depends(get_jwt_payload)]) -> int:
     user_id = jwt_payload.user_id
     if not user_id:
@@ -118,6 +235,158 @@ def get_user_role(jwt_payload: Annotated[JWTPayload, Depends(get_jwt_payload)])
     return UserRole(role)
 
 
+@app.get(
+    "/products",
+    response_model=GetProductsSchema,
+    tags=["Product"],
+)
+def get_products(
+    session: Annotated[so.Session, Depends(get_session)],
+    current_user: Annotated[Optional[int], Depends(get_optional_user)],
+    seller_id: Optional[int] = None,
+    product_status: Annotated[ProductStatus, Query(alias="status")] = ProductStatus.ACTIVE,
+    include_description: bool = False,
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+    after: Optional[str] = None,
+):
+    """Lists the products by seller and id, optionally the products of a
+    single seller. The products are paginated, pass the `next_cursor` of the
+    response as `after` to get the next page. Sellers can list their own
+    INACTIVE products. The description is skipped unless
+    `include_description` is set.
+    """
+    limit = min(limit or conf.PRODUCTS_PAGE_SIZE, conf.PRODUCTS_MAX_PAGE_SIZE)
+    if product_status != ProductStatus.ACTIVE and (
+        seller_id is None or seller_id != current_user
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the seller can list their inactive products",
+        )
+    try:
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor",
+        )
+
+    def load():
+        # Only the listed columns are read, the description can be large
+        columns = [
+            Product.id, Product.title, Product.user_id, Product.status,
+            Product.quantity, Product.created_at,
+        ]
+        if include_description:
+            columns.append(Product.description)
+
+        # Matches the (status, user_id, id) index, a page costs the same
+        # however deep it is.
+        stmt = sa.select(*columns).where(Product.status == product_status)
+        if seller_id is not None:
+            stmt = stmt.where(Product.user_id == seller_id)
+        if after_key is not None:
+            user_id, id_ = after_key
+            stmt = stmt.where(sa.or_(
+                Product.user_id > user_id,
+                sa.and_(Product.user_id == user_id, Product.id > id_),
+            ))
+        # Fetch one extra product to know if there is a next page
+        rows = session.execute(
+            stmt.order_by(Product.user_id, Product.id).limit(limit + 1)
+        ).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].user_id, rows[-1].id)
+        return GetProductsSchema(
+            products=[
+                ListProductSchema(**{**row._asdict(), "status": row.status.value})
+                for row in rows
+            ],
+            next_cursor=next_cursor,
+        ).model_dump()
+
+    # The cached page was validated by GetProductsSchema when it was loaded.
+    # Returned as a response it is serialised by orjson as it is, FastAPI
+    # validates only the content it serialises itself.
+    return ORJSONResponse(listing_cache.get_or_load(
+        (seller_id, product_status, include_description, after_key, limit), load,
+    ))
+
+
+# Defined before /products/{product_id}, which would match it otherwise
+@app.get(
+    "/products/search",
+    response_model=SearchProductsSchema,
+    tags=["Product"],
+)
+def search(
+    session: Annotated[so.Session, Depends(get_session)],
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    limit: Annotated[Optional[int], Query(ge=1)] = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+):
+    """Searches the active products by title and description, best match
+    first. Pass the `next_offset` of the response as `offset` to get the
+    next page.
+    """
+    limit = min(limit or conf.PRODUCTS_PAGE_SIZE, conf.PRODUCTS_MAX_PAGE_SIZE)
+    if offset > conf.PRODUCTS_SEARCH_MAX_OFFSET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Offset can't be more than {conf.PRODUCTS_SEARCH_MAX_OFFSET}, refine the search",
+        )
+
+    # Fetch one extra product to know if there is a next page
+    rows = search_products(session, q, limit + 1, offset)
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+
+    return ORJSONResponse({
+        "products": [
+            ListProductSchema(**{**row._asdict(), "status": row.status.value}).model_dump()
+            for row in rows
+        ],
+        "next_offset": next_offset,
+    })
+
+
+@app.get(
+    "/products/{product_id}",
+    response_model=GetProductSchema,
+    tags=["Product"],
+)
+def get_product(
+    product_id: int,
+    session: Annotated[so.Session, Depends(get_session)],
+):
+    def load():
+        product = session.scalars(sa.select(Product).where(
+            Product.id == product_id,
+            Product.status == ProductStatus.ACTIVE,
+        )).one_or_none()
+        if product is None:
+            # Cached as well, lookups of missing ids don't hit the DB either
+            return None
+
+        result = GetProductSchema.model_validate(product, from_attributes=True)
+        if hot_skus.is_hot(product_id):
+            # Product.quantity of a hot product lags behind its shards
+            result.quantity = hot_skus.available(session, product_id)
+        return result.model_dump()
+
+    product = product_cache.get_or_load(product_id, load)
+    if product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found",
+        )
+    return ORJSONResponse(product)
+
+
 @app.post(
     "/products",
     status_code=status.HTTP_201_CREATED,
@@ -146,9 +415,72 @@ def create_order(
     session.add(product)
     session.commit()
     session.refresh(product)
+    # A miss on the id may have been cached before the product existed
+    product_cache.invalidate(product.id)
+    listing_cache.clear()
     return product
 
 
+@app.post(
+    "/products/bulk",
+    response_model=BulkImportResultSchema,
+    tags=["Product"],
+)
+async def bulk_import_products(
+    request: Request,
+    user_id: Annotated[int, Depends(get_current_user)],
+    role: Annotated[UserRole, Depends(get_user_role)],
+):
+    """Creates and updates the products of the seller from an NDJSON
+    (application/x-ndjson) or CSV (text/csv, with a header) upload. Rows with
+    an `id` update that product, the others create one. The upload is
+    streamed and written in chunks, the response reports the rows which
+    failed.
+    """
+    if role != UserRole.seller:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a seller",
+        )
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_CONTENT_TYPES:
+        parse = ndjson_rows
+    elif content_type in CSV_CONTENT_TYPES:
+        parse = csv_rows
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Upload application/x-ndjson or text/csv",
+        )
+
+    bulk = BulkImport(Session, user_id, hot_skus, max_errors=conf.PRODUCTS_BULK_MAX_ERRORS)
+    chunk = []
+    try:
+        async for row_no, row, error in parse(read_lines(request.stream())):
+            product = bulk.validate(row_no, row, error)
+            if product is not None:
+                chunk.append((row_no, product))
+            if len(chunk) >= conf.PRODUCTS_BULK_CHUNK_SIZE:
+                await run_in_threadpool(bulk.write_chunk, chunk)
+                chunk = []
+        if chunk:
+            await run_in_threadpool(bulk.write_chunk, chunk)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Upload is not UTF-8, {bulk.created} created and {bulk.updated} updated before it",
+        )
+    finally:
+        # The misses are cached too, a created id may have been looked up
+        for product_id in bulk.written_ids:
+            product_cache.invalidate(product_id)
+        if bulk.created or bulk.updated:
+            listing_cache.clear()
+
+    return bulk.result()
+
+
 @app.put(
     "/products/{product_id}",
     response_model=GetProductSchema,
@@ -191,8 +523,12 @@ def update_product(
     product.quantity = product_data.quantity
     _status = product_data.status or product.status
     product.status = _status.value
+    if hot_skus.is_hot(product.id):
+        hot_skus.set_stock(session, product.id, product_data.quantity)
 
     session.commit()
+    product_cache.invalidate(product.id)
+    listing_cache.clear()
     session.refresh(product)
 
     return product
@@ -204,7 +540,7 @@ def buy_product(
     order_quantity: int,
     session: Annotated[so.Session, Depends(get_session)],
     jwt_payload: Annotated[JWTPayload, Depends(get_jwt_payload)],
-) -> JSONResponse:
+) -> ORJSONResponse:
     """This api is used by the orders service to buy a product.
     The product quantity will be descreased by the order amount.
     The api will return an error if the inventory is insufficient.
@@ -218,6 +554,18 @@ def buy_product(
             detail="Thsi is an internal api",
         )
 
+    remaining = reserve_stock(session, product_id, order_quantity, hot_skus)
+    if remaining is not None:
+        session.commit()
+        product_cache.invalidate(product_id)
+        listing_cache.clear()
+        return ORJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"product_id": product_id, "remaining_quantity": remaining},
+        )
+
+    # Nothing was reserved, query the product to tell why
+    session.rollback()
     product = session.scalars(sa.select(Product).where(
         Product.id == product_id,
         Product.status == ProductStatus.ACTIVE,
@@ -229,44 +577,264 @@ def buy_product(
             detail="Product not found",
         )
 
-    if product.quantity < order_quantity:
+    available = product.quantity
+    if hot_skus.is_hot(product_id):
+        available = hot_skus.available(session, product_id)
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT, 
+        detail=f"Insufficient quantity. Available: {available}, Requested: {order_quantity}"
+    )
+
+
+@app.post(
+    '/products/buy',
+    response_model=BuyProductsResultSchema,
+    tags=["Product"],
+)
+def buy_products(
+    payload: BuyProductsSchema,
+    session: Annotated[so.Session, Depends(get_session)],
+    jwt_payload: Annotated[JWTPayload, Depends(get_jwt_payload)],
+):
+    """Batch version of `buy_product` used by the orders service to book all
+    the items of an order in a single round trip and a single transaction.
+    The api returns 409 with the per item result if the batch is
+    all-or-nothing and any of the items can't be booked.
+    """
+
+    if jwt_payload.iss != TokenIssuer.order_srv.value:
         raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, 
-            detail=f"Insufficient quantity. Available: {product.quantity}, Requested: {order_quantity}"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Thsi is an internal api",
         )
 
-    # Use optimistic concurrency control to reduce the product quantity
-    stmt = sa.update(Product).where(
-        Product.id == product_id,
-        Product.status == ProductStatus.ACTIVE,
-        Product.quantity - order_quantity >= 0,
-    ).values(quantity=Product.quantity - order_quantity)
+    if payload.reservation_id:
+        reservation = session.get(Reservation, payload.reservation_id)
+        if reservation and reservation.status == ReservationStatus.RELEASED:
+            # Released, possibly before this booking arrived. Nothing is
+            # booked under the id any more.
+            return BuyProductsResultSchema(items=[
+                BuyProductItemResultSchema(
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    booked=False,
+                    detail="Reservation was released",
+                )
+                for item in payload.items
+            ])
+        if reservation:
+            # Retry of a booking which already went through
+            return reservation.result
+
+    remaining = [None] * len(payload.items)
+
+    # Update the rows in a stable order so that two batches booking the same
+    # products concurrently can't deadlock on the row locks.
+    ordering = sorted(
+        range(len(payload.items)), key=lambda i: payload.items[i].product_id,
+    )
+    for i in ordering:
+        item = payload.items[i]
+        remaining[i] = reserve_stock(
+            session, item.product_id, item.quantity, hot_skus,
+        )
+    booked = [r is not None for r in remaining]
+
+    committed = all(booked) or payload.allow_partial
+    if not committed:
+        session.rollback()
+
+    # Only the failed items need another look at the table, to tell the
+    # caller why they were not booked.
+    failed_ids = {
+        item.product_id for item, ok in zip(payload.items, booked) if not ok
+    }
+    available = {}
+    if failed_ids:
+        available = dict(session.execute(sa.select(Product.id, Product.quantity).where(
+            Product.id.in_(failed_ids),
+            Product.status == ProductStatus.ACTIVE,
+        )).all())
+        for product_id in available:
+            if hot_skus.is_hot(product_id):
+                available[product_id] = hot_skus.available(session, product_id)
+
+    results = []
+    for item, ok, left in zip(payload.items, booked, remaining):
+        detail = None
+        if not ok and item.product_id not in available:
+            detail = "Product not found"
+        elif not ok:
+            detail = f"Insufficient quantity. Available: {available[item.product_id]}, Requested: {item.quantity}"
+        elif not committed:
+            detail = "Not booked as other items in the batch can't be booked"
+        results.append(BuyProductItemResultSchema(
+            product_id=item.product_id,
+            quantity=item.quantity,
+            booked=ok and committed,
+            remaining_quantity=left if committed else None,
+            detail=detail,
+        ))
+
+    result = BuyProductsResultSchema(items=results)
+    if not committed:
+        return ORJSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content=result.model_dump(),
+        )
 
-    result = session.execute(stmt)
-    rows_updated = result.rowcount
-    session.commit()
+    if payload.reservation_id:
+        # Stored in the same transaction as the bookings
+        session.add(Reservation(
+            id=payload.reservation_id, result=result.model_dump(),
+        ))
+    try:
+        session.commit()
+    except sa.exc.IntegrityError:
+        # A concurrent retry of the same booking committed first, undo this
+        # one and return the result of the other.
+        session.rollback()
+        return session.get(Reservation, payload.reservation_id).result
 
-    # query the product again
-    product = session.scalars(sa.select(Product).where(
-        Product.id == product_id,
-        Product.status == ProductStatus.ACTIVE,
-    )).one_or_none()
+    for item in results:
+        if item.booked:
+            product_cache.invalidate(item.product_id)
+    if any(item.booked for item in results):
+        listing_cache.clear()
 
-    if not product:
+    return result
+
+
+@app.post(
+    '/products/release',
+    response_model=ReleaseProductsResultSchema,
+    tags=["Product"],
+)
+def release_products(
+    payload: ReleaseProductsSchema,
+    session: Annotated[so.Session, Depends(get_session)],
+    jwt_payload: Annotated[JWTPayload, Depends(get_jwt_payload)],
+):
+    """Gives back the stock booked through `buy_products` under the
+    reservation ids, eg. when an order is cancelled. Used by the orders
+    service, safe to retry.
+    """
+
+    if jwt_payload.iss != TokenIssuer.order_srv.value:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, 
-            detail="Product not found",
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Thsi is an internal api",
         )
 
-    if rows_updated == 0:
+    results = {}
+    to_release = defaultdict(int)
+    for reservation_id in sorted(set(payload.reservation_ids)):
+        reservation = session.get(Reservation, reservation_id)
+        if reservation is None:
+            # The booking may still be in flight. Record the id as released
+            # so that the booking can't go through afterwards.
+            session.add(Reservation(
+                id=reservation_id,
+                result=BuyProductsResultSchema(items=[]).model_dump(),
+                status=ReservationStatus.RELEASED,
+                released_at=datetime.utcnow(),
+            ))
+            results[reservation_id] = ReleaseResultSchema(
+                reservation_id=reservation_id,
+                released=False,
+                detail="Nothing was booked",
+            )
+            continue
+
+        # Compare and set, a concurrent release of the same id gives back
+        # the stock only once.
+        rows = session.execute(
+            sa.update(Reservation)
+            .where(
+                Reservation.id == reservation_id,
+                Reservation.status == ReservationStatus.RESERVED,
+            )
+            .values(status=ReservationStatus.RELEASED, released_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if rows != 1:
+            results[reservation_id] = ReleaseResultSchema(
+                reservation_id=reservation_id,
+                released=False,
+                detail="Already released",
+            )
+            continue
+
+        for item in reservation.result["items"]:
+            if item["booked"]:
+                to_release[item["product_id"]] += item["quantity"]
+        results[reservation_id] = ReleaseResultSchema(
+            reservation_id=reservation_id, released=True,
+        )
+
+    # Update the products in a stable order, like buy_products
+    for product_id in sorted(to_release):
+        release_stock(session, product_id, to_release[product_id], hot_skus)
+
+    try:
+        session.commit()
+    except sa.exc.IntegrityError:
+        # A booking of one of the ids committed while releasing, the caller
+        # retries and releases it then.
+        session.rollback()
         raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, 
-            detail=f"Insufficient quantity. Available: {product.quantity}, Requested: {order_quantity}"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Reservation was booked concurrently, retry",
         )
 
-    return JSONResponse(
-        status_code=status.HTTP_200_OK,
-        content={},
+    for product_id in to_release:
+        product_cache.invalidate(product_id)
+    if to_release:
+        listing_cache.clear()
+
+    return ReleaseProductsResultSchema(
+        items=[results[reservation_id] for reservation_id in sorted(results)],
     )
+
+
+@internal.get('/internal/product_cache')
+def get_product_cache_stats():
+    return {
+        "products": product_cache.stats(),
+        "listing": listing_cache.stats(),
+    }
+
+
+@internal.get('/internal/jwt_cache')
+def get_jwt_cache_stats():
+    return token_cache.stats()
+
+
+@internal.get('/internal/traces')
+def get_traces(trace_id: Optional[str] = None):
+    """Spans kept in memory by this process, the latest last. Empty with the
+    file exporter.
+    """
+    return tracer.exporter.spans(trace_id)
+
+
+@internal.get('/internal/sql_profile')
+def get_sql_profile(limit: Annotated[int, Query(ge=1)] = 20):
+    """The statements which took the most DB time and the queries per
+    route, over the sampled requests
+    """
+    return sql_profiler.report(limit)
+
+
+@internal.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    """Metrics of this process in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+app.include_router(internal)
+
+
 if __name__ == '__main__':
         uvicorn.run("app:app", host="0.0.0.0", port=8002, reload=True)
@@ -0,0 +1,193 @@
+import csv
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import pydantic
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from db import Product, ProductStatus
+from hot_inventory import HotSkuInventory
+from schemas import BulkCreateRowSchema, BulkUpdateRowSchema
+
+# Bulk import of products from NDJSON or CSV uploads. The upload is read and
+# validated a chunk of rows at a time, each chunk is written with one
+# executemany INSERT and one UPDATE by primary key. Only the current chunk
+# and the error report are held in memory.
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+CSV_CONTENT_TYPES = ("text/csv",)
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Splits the streamed body in lines"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+
+async def ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yields (row number, row, error) for the non empty lines"""
+    row_no = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_no += 1
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_no, None, f"Invalid JSON: {e.msg}"
+            continue
+        if not isinstance(row, dict):
+            yield row_no, None, "Expected a JSON object"
+            continue
+        yield row_no, row, None
+
+
+async def csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yields (row number, row, error) for the records after the header. A
+    quoted field can span lines, the lines are joined till the quotes are
+    balanced.
+    """
+    header = None
+    row_no = 0
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+
+        row_no += 1
+        if len(values) != len(header):
+            yield row_no, None, f"Expected {len(header)} fields, got {len(values)}"
+            continue
+        # Empty cells are missing values, eg. the id of a new product
+        yield row_no, {k: v for k, v in zip(header, values) if v != ""}, None
+
+    if record:
+        row_no += 1
+        yield row_no, None, "Unterminated quoted field"
+
+
+class BulkImport:
+    """Writes the validated rows of an upload to the products of a seller.
+
+    Rows without an id create products, rows with the id of a product of the
+    seller update the fields given in the row. Each chunk is committed on
+    its own, the chunks written before a failure stay.
+    """
+
+    def __init__(
+        self,
+        session_factory: so.sessionmaker,
+        user_id: int,
+        hot_skus: HotSkuInventory,
+        max_errors: int = 1000,
+    ):
+        self.session_factory = session_factory
+        self.user_id = user_id
+        self.hot_skus = hot_skus
+        self.max_errors = max_errors
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+        # Ids of the created and updated products, to invalidate the caches
+        self.written_ids: List[int] = []
+
+    def validate(
+        self, row_no: int, row: Optional[Dict], error: Optional[str],
+    ) -> BulkCreateRowSchema | BulkUpdateRowSchema | None:
+        if error is None:
+            schema = BulkUpdateRowSchema if "id" in row else BulkCreateRowSchema
+            try:
+                # Updates don't allow null, a row sets the fields it has
+                return schema.model_validate(
+                    {k: v for k, v in row.items() if v is not None}
+                    if schema is BulkUpdateRowSchema else row
+                )
+            except pydantic.ValidationError as e:
+                error = "; ".join(
+                    f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+                    for err in e.errors()
+                )
+        self.fail(row_no, error)
+        return None
+
+    def fail(self, row_no: int, error: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row_no, "error": error})
+
+    def write_chunk(self, chunk: List[Tuple[int, BulkCreateRowSchema | BulkUpdateRowSchema]]):
+        """Runs in a worker thread, the DB calls are blocking"""
+        inserts = []
+        updates = []
+        for row_no, row in chunk:
+            if isinstance(row, BulkCreateRowSchema):
+                inserts.append({
+                    **row.model_dump(),
+                    "status": ProductStatus.ACTIVE,
+                    "user_id": self.user_id,
+                })
+            else:
+                updates.append((row_no, row))
+
+        with self.session_factory() as session:
+            created_ids = []
+            if inserts:
+                created_ids = list(session.scalars(
+                    sa.insert(Product).returning(Product.id), inserts,
+                ))
+
+            owned = set()
+            if updates:
+                owned = set(session.scalars(sa.select(Product.id).where(
+                    Product.id.in_([row.id for _, row in updates]),
+                    Product.user_id == self.user_id,
+                )))
+
+            values = []
+            for row_no, row in updates:
+                if row.id not in owned:
+                    self.fail(row_no, f"Product {row.id} not found")
+                    continue
+                if row.model_fields_set == {"id"}:
+                    # Nothing to update, the nulls were dropped
+                    continue
+                values.append(row.model_dump(exclude_unset=True))
+                if "quantity" in row.model_fields_set and self.hot_skus.is_hot(row.id):
+                    self.hot_skus.set_stock(session, row.id, row.quantity)
+            if values:
+                # ORM bulk UPDATE by primary key, one executemany. Rows
+                # with different columns are grouped by SQLAlchemy.
+                session.execute(sa.update(Product), values)
+
+            session.commit()
+
+        self.created += len(created_ids)
+        self.updated += len(values)
+        self.written_ids.extend(created_ids)
+        self.written_ids.extend(value["id"] for value in values)
+
+    def result(self) -> Dict:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+class ReadThroughCache:
+    """Bounded LRU cache of read results, loaded on a miss.
+
+    Entries expire after `ttl` seconds, that's how long another process can
+    serve a stale entry. Writes in this process invalidate the entries right
+    away. Concurrent misses of the same key are coalesced: one request loads
+    the entry and the others wait for its result, so a popular entry which
+    expires doesn't send a burst of identical queries to the DB.
+
+    A load which started before an invalidation is returned to its callers
+    but not cached, so an invalidation can't be undone by a load in flight.
+    A `maxsize` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl: float = 30, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        # Loads in flight. An invalidation removes the load of its key, a
+        # load is only cached if it's still the one of its key when it ends.
+        self._loading: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Returns the cached value of the key or the one returned by `load`.
+        The errors raised by `load` are propagated and nothing is cached.
+        The returned value is shared between requests, don't modify it.
+        """
+        if self.maxsize <= 0:
+            return load()
+
+        owner = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() < entry[1]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+
+            loading = self._loading.get(key)
+            if loading is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                loading = self._loading[key] = Future()
+                owner = True
+
+        if not owner:
+            # Loaded by another request
+            return loading.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+            loading.set_exception(e)
+            raise
+
+        with self._lock:
+            if self._loading.get(key) is loading:
+                del self._loading[key]
+                self._entries[key] = (value, time.monotonic() + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        loading.set_result(value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            # Later misses load the key again instead of waiting for a load
+            # which may have read the old value
+            self._loading.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
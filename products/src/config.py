@@ -1,7 +1,57 @@
+from typing import List
+
 from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
     PRODUCTS_DB_URL: str = 'sqlite:///users.db'
+    # Logs every query, too expensive to leave on. See the profiler below.
+    PRODUCTS_DB_ECHO: bool = False
+    # Share of the requests whose queries are aggregated for
+    # /internal/sql_profile. The queries slower than SLOW_QUERY_SECONDS are
+    # logged, with their plan if EXPLAIN_SLOW_QUERIES is set.
+    PRODUCTS_DB_PROFILE_SAMPLE_RATIO: float = 0.01
+    PRODUCTS_DB_SLOW_QUERY_SECONDS: float = 0.5
+    PRODUCTS_DB_EXPLAIN_SLOW_QUERIES: bool = True
     AUTH_JWT_PUBLIC_KEY_FILE: str = 'public_key.pem'
     AUTH_JWT_PRIVATE_KEY_FILE: str = 'private_key.pem'
-
+    # RS256, ES256 or EdDSA. Has to match the type of the keys and the
+    # algorithm configured in the other services.
+    AUTH_JWT_ALGORITHM: str = 'RS256'
+    # Number of verified tokens cached by the service, 0 to disable the cache
+    AUTH_JWT_CACHE_SIZE: int = 10000
+    # Bearer token of /internal/* and /metrics, they are not served without
+    # one. Give it to the monitoring, eg. the Prometheus scrape config.
+    INTERNAL_API_TOKEN: str | None = None
+    # Products with a lot of concurrent orders, eg. HOT_SKU_PRODUCT_IDS=[1,2]
+    # Their stock is split in HOT_SKU_SHARDS counters, see hot_inventory.py.
+    # Has to be the same for all the processes of the service.
+    HOT_SKU_PRODUCT_IDS: List[int] = []
+    HOT_SKU_SHARDS: int = 8
+    # How often the stock of the shards is rebalanced and written back to
+    # the products table
+    HOT_SKU_RECONCILE_INTERVAL_SECONDS: float = 5.0
+    # Products and pages of the product listing are cached per process for
+    # TTL seconds, that's how long another process can serve a stale
+    # product. Writes in the process invalidate its cache right away. A size
+    # of 0 disables the cache.
+    PRODUCTS_CACHE_TTL_SECONDS: float = 30.0
+    PRODUCTS_CACHE_SIZE: int = 10000
+    PRODUCTS_LIST_CACHE_SIZE: int = 1000
+    # Page size of GET /products if the client doesn't ask for one, and the
+    # max page size a client can ask for
+    PRODUCTS_PAGE_SIZE: int = 20
+    PRODUCTS_MAX_PAGE_SIZE: int = 100
+    # Deepest result of the product search a client can page to
+    PRODUCTS_SEARCH_MAX_OFFSET: int = 1000
+    # Rows of POST /products/bulk written per transaction, and the max number
+    # of row errors reported back
+    PRODUCTS_BULK_CHUNK_SIZE: int = 1000
+    PRODUCTS_BULK_MAX_ERRORS: int = 1000
+    # Share of the requests which are traced, 0 turns the tracing off. A
+    # request traced by its caller is always traced. The spans are kept in
+    # memory for /internal/traces, or appended to TRACING_FILE with the
+    # "file" exporter.
+    TRACING_SAMPLE_RATIO: float = 0.0
+    TRACING_EXPORTER: str = "memory"
+    TRACING_FILE: str = "spans.jsonl"
+    TRACING_MEMORY_SPANS: int = 10000
@@ -0,0 +1,19 @@
+import base64
+import json
+
+
+# Cursors are opaque to the clients. They hold the sort key of the last
+# product of a page, ie. (user_id, id), and the next page starts after it.
+
+def encode_cursor(user_id: int, id_: int) -> str:
+    raw = json.dumps([user_id, id_]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    """Raises ValueError if the cursor is invalid"""
+    try:
+        user_id, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(user_id), int(id_)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
@@ -1,5 +1,6 @@
 import enum
 from datetime import datetime
+from typing import Optional
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
@@ -12,6 +13,15 @@ class ProductStatus(enum.Enum):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Backs the keyset pagination of GET /products, with or without a
+        # seller. The listed columns are included so that Postgres can serve
+        # a page from the index alone.
+        sa.Index(
+            "ix_products_status_user_id_id", "status", "user_id", "id",
+            postgresql_include=["title", "quantity", "created_at"],
+        ),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     title: so.Mapped[str]
@@ -27,3 +37,41 @@ class Product(Base):
 
     def __repr__(self) -> str:
         return f"<Product id={self.id} title={self.title} user_id={self.user_id} quantity={self.quantity}>"
+
+
+class ProductStockShard(Base):
+    """Stock of a hot product split in sub-counters, see hot_inventory.py.
+    Reservations of a hot product are spread over its shards instead of
+    all of them updating the same products row.
+    """
+    __tablename__ = "product_stock_shards"
+
+    product_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("products.id"), primary_key=True)
+    shard: so.Mapped[int] = so.mapped_column(primary_key=True)
+    quantity: so.Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"<ProductStockShard product_id={self.product_id} shard={self.shard} quantity={self.quantity}>"
+
+
+class ReservationStatus(enum.Enum):
+    RESERVED = 'RESERVED'
+    # The booked stock was given back
+    RELEASED = 'RELEASED'
+
+
+class Reservation(Base):
+    """Result of a batch booking, stored under the reservation id sent by
+    the orders service. A retry of the booking gets the stored result
+    instead of booking the products again.
+    """
+    __tablename__ = "reservations"
+
+    id: so.Mapped[str] = so.mapped_column(primary_key=True)
+    result: so.Mapped[dict] = so.mapped_column(sa.JSON)
+    status: so.Mapped[ReservationStatus] = so.mapped_column(default=ReservationStatus.RESERVED)
+    created_at: so.Mapped[datetime] = so.mapped_column(server_default=sa.func.current_timestamp())
+    released_at: so.Mapped[Optional[datetime]]
+
+    def __repr__(self) -> str:
+        return f"<Reservation id={self.id} status={self.status}>"
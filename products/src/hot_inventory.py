@@ -0,0 +1,305 @@
+import logging
+import random
+from typing import Iterable, List
+
+import sqlalchemy as sa
+import sqlalchemy.dialects.postgresql as pg
+import sqlalchemy.dialects.sqlite as sqlite
+import sqlalchemy.orm as so
+
+from db import Product, ProductStatus, ProductStockShard
+
+
+def split_quantity(quantity: int, shards: int) -> List[int]:
+    """Splits the quantity as evenly as possible, eg. 10 in 4 is [3, 3, 2, 2]"""
+    base, extra = divmod(quantity, shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+class HotSkuInventory:
+    """Opt-in inventory mode for products which take a lot of concurrent
+    orders, eg. during a flash sale.
+
+    Every reservation of a product updates the same products row, so
+    concurrent orders of the product wait on each other for the row lock.
+    The stock of a hot product is split in `shards` rows of
+    product_stock_shards and a reservation only locks one of them.
+
+    For a hot product:
+    - the shards hold the stock which can be reserved
+    - Product.quantity is the total of the shards as of the last
+      `reconcile`, it's only used to display the stock
+    - reservations never touch the products row
+
+    Every decrement of a shard is a conditional UPDATE, so a shard never
+    goes below 0 and a product can't be oversold. The set of hot products
+    has to be the same in all the processes of the service. The processes
+    may shard a product at the same time, the shards of the first one win.
+    """
+
+    def __init__(self, product_ids: Iterable[int], shards: int = 8):
+        self.product_ids = frozenset(product_ids)
+        self.shards = shards
+
+    def is_hot(self, product_id: int) -> bool:
+        return product_id in self.product_ids
+
+    def sync(self, session: so.Session):
+        """Splits the stock of the hot products which are not sharded yet, or
+        were sharded with another number of shards, and folds back the shards
+        of the products which are no longer hot.
+        Run at startup by every process, concurrent runs are safe.
+        """
+        if not sa.inspect(session.connection()).has_table(ProductStockShard.__tablename__):
+            # A fresh DB, migrations.py creates the tables
+            logging.warning("No product_stock_shards table, the hot products are not sharded")
+            return
+
+        sharded = set(session.scalars(
+            sa.select(ProductStockShard.product_id).distinct()
+        ))
+
+        for product_id in self.product_ids - sharded:
+            quantity = self._quantity(session, product_id)
+            if quantity is None:
+                logging.info(f"Hot product {product_id} doesn't exist yet, it is sharded by its first reservation")
+                continue
+            self._write_shards(session, product_id, quantity)
+
+        for product_id in sharded - self.product_ids:
+            self.reconcile(session, product_id, rebalance=False)
+            session.execute(sa.delete(ProductStockShard).where(
+                ProductStockShard.product_id == product_id,
+            ))
+
+        session.commit()
+
+        # Sharded with another HOT_SKU_SHARDS
+        for product_id in self.product_ids & sharded:
+            if self._resplit(session, product_id):
+                session.commit()
+            else:
+                session.rollback()
+                logging.info(f"Shards of product {product_id} changed while resplitting them, they are kept as is")
+
+    def reserve(self, session: so.Session, product_id: int, quantity: int) -> int | None:
+        """Reserves the quantity from the shards of the product. Returns the
+        stock left across the shards, or None if nothing was reserved. The
+        caller commits the transaction.
+        """
+        product_is_active = sa.exists().where(
+            Product.id == product_id,
+            Product.status == ProductStatus.ACTIVE,
+        )
+
+        # Start at a random shard so that concurrent reservations spread
+        # over the shards.
+        start = random.randrange(self.shards)
+        for i in range(self.shards):
+            shard = (start + i) % self.shards
+            stmt = sa.update(ProductStockShard).where(
+                ProductStockShard.product_id == product_id,
+                ProductStockShard.shard == shard,
+                ProductStockShard.quantity >= quantity,
+                product_is_active,
+            ).values(
+                quantity=ProductStockShard.quantity - quantity,
+            ).execution_options(synchronize_session=False)
+            if session.execute(stmt).rowcount == 1:
+                return self.available(session, product_id)
+
+        # No single shard has enough stock, the quantity may still be
+        # available across the shards.
+        if not session.scalar(sa.select(product_is_active)):
+            return None
+        if not self._is_sharded(session, product_id):
+            # Created after the startup, eg. a product made hot before its
+            # sale. It is sharded by the first reservation.
+            self._write_shards(session, product_id, self._quantity(session, product_id))
+            return self.reserve(session, product_id, quantity)
+        if self._take_across_shards(session, product_id, quantity):
+            return self.available(session, product_id)
+        return None
+
+    def release(self, session: so.Session, product_id: int, quantity: int):
+        """Gives back reserved stock to a random shard of the product. The
+        caller commits the transaction.
+        """
+        # One of the shards which exist, the product may have been sharded
+        # with another HOT_SKU_SHARDS
+        shard = self._random_shard(session, product_id)
+        if shard is None:
+            self._write_shards(session, product_id, self._quantity(session, product_id))
+            shard = self._random_shard(session, product_id)
+        stmt = sa.update(ProductStockShard).where(
+            ProductStockShard.product_id == product_id,
+            ProductStockShard.shard == shard,
+        ).values(
+            quantity=ProductStockShard.quantity + quantity,
+        ).execution_options(synchronize_session=False)
+        if session.execute(stmt).rowcount != 1:
+            # Resplit concurrently, fail rather than lose the stock
+            raise RuntimeError(f"Shard {shard} of product {product_id} is gone, the stock was not released")
+
+    def set_stock(self, session: so.Session, product_id: int, quantity: int):
+        """Replaces the stock of the product, eg. when the seller updates it"""
+        session.execute(sa.delete(ProductStockShard).where(
+            ProductStockShard.product_id == product_id,
+        ))
+        self._write_shards(session, product_id, quantity)
+
+    def reconcile(self, session: so.Session, product_id: int, rebalance: bool = True) -> bool:
+        """Writes the total of the shards to Product.quantity and spreads the
+        stock evenly over the shards again. Returns False if the shards
+        changed concurrently, the transaction has to be rolled back then.
+        """
+        rows = session.execute(
+            sa.select(ProductStockShard.shard, ProductStockShard.quantity)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(ProductStockShard.shard)
+            .with_for_update()
+        ).all()
+        if not rows:
+            # Not sharded, or folded back by another process
+            return True
+        total = sum(quantity for _, quantity in rows)
+
+        if rebalance:
+            targets = split_quantity(total, len(rows))
+            for (shard, current), target in zip(rows, targets):
+                if current == target:
+                    continue
+                # Compare and set, on DBs which ignore FOR UPDATE (sqlite) a
+                # reservation may have changed the shard since the read. The
+                # caller rolls back the transaction in that case.
+                stmt = sa.update(ProductStockShard).where(
+                    ProductStockShard.product_id == product_id,
+                    ProductStockShard.shard == shard,
+                    ProductStockShard.quantity == current,
+                ).values(quantity=target).execution_options(synchronize_session=False)
+                if session.execute(stmt).rowcount != 1:
+                    return False
+
+        session.execute(
+            sa.update(Product)
+            .where(Product.id == product_id)
+            .values(quantity=total)
+            .execution_options(synchronize_session=False)
+        )
+        return True
+
+    def reconcile_all(self, session_factory: so.sessionmaker):
+        for product_id in self.product_ids:
+            with session_factory() as session:
+                if self.reconcile(session, product_id):
+                    session.commit()
+                else:
+                    session.rollback()
+                    logging.info(f"Shards of product {product_id} changed while reconciling, retrying later")
+
+    def _resplit(self, session: so.Session, product_id: int) -> bool:
+        """Splits the stock of the product in `self.shards` shards if it has
+        another number of them. Returns False if the shards changed
+        concurrently, the transaction has to be rolled back then.
+        """
+        rows = session.execute(
+            sa.select(ProductStockShard.shard, ProductStockShard.quantity)
+            .where(ProductStockShard.product_id == product_id)
+            .with_for_update()
+        ).all()
+        if not rows or len(rows) == self.shards:
+            return True
+
+        for shard, current in rows:
+            # Compare and delete, see reconcile
+            stmt = sa.delete(ProductStockShard).where(
+                ProductStockShard.product_id == product_id,
+                ProductStockShard.shard == shard,
+                ProductStockShard.quantity == current,
+            ).execution_options(synchronize_session=False)
+            if session.execute(stmt).rowcount != 1:
+                return False
+        self._write_shards(session, product_id, sum(quantity for _, quantity in rows))
+        return True
+
+    def _take_across_shards(self, session: so.Session, product_id: int, quantity: int) -> bool:
+        rows = session.execute(
+            sa.select(ProductStockShard.shard, ProductStockShard.quantity)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(ProductStockShard.shard)
+            .with_for_update()
+        ).all()
+        if sum(available for _, available in rows) < quantity:
+            return False
+
+        taken = []
+        remaining = quantity
+        for shard, available in rows:
+            take = min(available, remaining)
+            if take == 0:
+                continue
+            stmt = sa.update(ProductStockShard).where(
+                ProductStockShard.product_id == product_id,
+                ProductStockShard.shard == shard,
+                ProductStockShard.quantity >= take,
+            ).values(
+                quantity=ProductStockShard.quantity - take,
+            ).execution_options(synchronize_session=False)
+            if session.execute(stmt).rowcount != 1:
+                # Taken by a concurrent reservation, give back what was
+                # taken so far. The rest of the transaction stays as is.
+                for shard, take in taken:
+                    session.execute(sa.update(ProductStockShard).where(
+                        ProductStockShard.product_id == product_id,
+                        ProductStockShard.shard == shard,
+                    ).values(
+                        quantity=ProductStockShard.quantity + take,
+                    ).execution_options(synchronize_session=False))
+                return False
+            taken.append((shard, take))
+            remaining -= take
+            if remaining == 0:
+                break
+        return True
+
+    def _write_shards(self, session: so.Session, product_id: int, quantity: int):
+        dialect = session.get_bind().dialect.name
+        if dialect == "postgresql":
+            stmt = pg.insert(ProductStockShard).on_conflict_do_nothing()
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(ProductStockShard).on_conflict_do_nothing()
+        else:
+            stmt = sa.insert(ProductStockShard)
+        # A process sharding the product concurrently wrote the same split
+        # of the same quantity, its rows are kept
+        session.execute(stmt, [
+            {"product_id": product_id, "shard": shard, "quantity": q}
+            for shard, q in enumerate(split_quantity(quantity, self.shards))
+        ])
+
+    def available(self, session: so.Session, product_id: int) -> int:
+        """Stock which can be reserved, Product.quantity may lag behind it"""
+        total = session.scalar(
+            sa.select(sa.func.sum(ProductStockShard.quantity))
+            .where(ProductStockShard.product_id == product_id)
+        )
+        if total is None:
+            # Not sharded yet, the stock is in the products row
+            return self._quantity(session, product_id)
+        return total
+
+    def _is_sharded(self, session: so.Session, product_id: int) -> bool:
+        return session.scalar(sa.select(sa.exists().where(
+            ProductStockShard.product_id == product_id,
+        )))
+
+    def _random_shard(self, session: so.Session, product_id: int) -> int | None:
+        return session.scalar(
+            sa.select(ProductStockShard.shard)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(sa.func.random())
+            .limit(1)
+        )
+
+    def _quantity(self, session: so.Session, product_id: int) -> int | None:
+        return session.scalar(sa.select(Product.quantity).where(Product.id == product_id))
@@ -0,0 +1,69 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from db import Product, ProductStatus
+from ecomm_common.tracing import traced
+from hot_inventory import HotSkuInventory
+
+
+@traced
+def reserve_stock(
+    session: so.Session,
+    product_id: int,
+    quantity: int,
+    hot_skus: HotSkuInventory | None = None,
+) -> int | None:
+    """Decrements the stock of an active product if it has enough of it.
+    Returns the remaining stock, or None if nothing was reserved.
+
+    The check and the decrement are a single conditional UPDATE, so two
+    concurrent reservations can't both take the last items. The stock of
+    hot products is reserved from their shards. The caller commits the
+    transaction.
+    """
+    if hot_skus is not None and hot_skus.is_hot(product_id):
+        return hot_skus.reserve(session, product_id, quantity)
+
+    stmt = sa.update(Product).where(
+        Product.id == product_id,
+        Product.status == ProductStatus.ACTIVE,
+        Product.quantity >= quantity,
+    ).values(
+        quantity=Product.quantity - quantity,
+    ).execution_options(synchronize_session=False)
+
+    if session.get_bind().dialect.update_returning:
+        return session.execute(
+            stmt.returning(Product.quantity)
+        ).scalar_one_or_none()
+
+    # Emulation for DBs without UPDATE .. RETURNING, eg. sqlite < 3.35. The
+    # row stays locked by the UPDATE till the end of the transaction, so the
+    # SELECT reads the quantity left by this reservation.
+    if session.execute(stmt).rowcount != 1:
+        return None
+    return session.scalars(
+        sa.select(Product.quantity).where(Product.id == product_id)
+    ).one()
+
+
+@traced
+def release_stock(
+    session: so.Session,
+    product_id: int,
+    quantity: int,
+    hot_skus: HotSkuInventory | None = None,
+):
+    """Gives back stock taken by `reserve_stock`. The caller commits the
+    transaction.
+    """
+    if hot_skus is not None and hot_skus.is_hot(product_id):
+        hot_skus.release(session, product_id, quantity)
+        return
+
+    session.execute(
+        sa.update(Product)
+        .where(Product.id == product_id)
+        .values(quantity=Product.quantity + quantity)
+        .execution_options(synchronize_session=False)
+    )
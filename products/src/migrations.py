@@ -3,6 +3,7 @@ import sqlalchemy.orm as so
 from db import Base, ProductStatus, Product
 
 from config import AppConfig
+from search import ensure_search_index
 
 def main():
     conf = AppConfig()
@@ -14,6 +15,7 @@ def main():
 
     print("Creating tables in Products DB")
     Base.metadata.create_all(engine)
+    ensure_search_index(engine)
     print("Successfully created tables in Products DB")
 
     print("Creating seed data in Products DB")
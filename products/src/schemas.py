@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Annotated, List, Optional
 import enum
 
 class GetProductSchema(BaseModel):
@@ -17,6 +17,36 @@ class CreateProductSchema(BaseModel):
     description: str
     quantity: Optional[int] = 1
 
+class BulkCreateRowSchema(CreateProductSchema):
+    """Row of POST /products/bulk without an id, creates a product"""
+    quantity: Annotated[int, Field(ge=0)] = 1
+
+
+class BulkUpdateRowSchema(BaseModel):
+    """Row of POST /products/bulk with an id, updates the fields given in the
+    row
+    """
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    quantity: Optional[Annotated[int, Field(ge=0)]] = None
+
+
+class BulkRowErrorSchema(BaseModel):
+    # 1 based, the header of a CSV upload is not counted
+    row: int
+    error: str
+
+
+class BulkImportResultSchema(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    errors: List[BulkRowErrorSchema]
+    # The report is capped, the count of failed rows is not
+    errors_truncated: bool
+
+
 class ProductStatus(enum.Enum):
     ACTIVE = 'ACTIVE'
     INACTIVE = 'INACTIVE'
@@ -27,3 +57,77 @@ class UpdateProductSchema(BaseModel):
     quantity: int
     status: Optional[ProductStatus] = None
 
+
+class ListProductSchema(BaseModel):
+    id: int
+    title: str
+    # Only when asked for, the listing skips it otherwise
+    description: Optional[str] = None
+    user_id: int
+    status: ProductStatus
+    quantity: int
+    created_at: datetime
+
+
+class GetProductsSchema(BaseModel):
+    products: List[ListProductSchema]
+    # Pass as `after` to get the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class SearchProductsSchema(BaseModel):
+    products: List[ListProductSchema]
+    # Pass as `offset` to get the next page, None on the last page
+    next_offset: Optional[int] = None
+
+
+class BuyProductItemSchema(BaseModel):
+    product_id: int
+    quantity: Annotated[int, Field(ge=1)] = 1
+
+
+class BuyProductsSchema(BaseModel):
+    """Batch reservation request sent by the orders service.
+
+    With `allow_partial` unset the batch is all-or-nothing: if any item can't
+    be reserved nothing is. Otherwise the reservable items are booked and the
+    rest are reported back as not booked.
+    A booking with a `reservation_id` is idempotent, the retries get the
+    result of the first booking which went through.
+    """
+    items: Annotated[List[BuyProductItemSchema], Field(min_length=1)]
+    allow_partial: bool = False
+    reservation_id: Optional[Annotated[str, Field(max_length=128)]] = None
+
+
+class BuyProductItemResultSchema(BaseModel):
+    product_id: int
+    quantity: int
+    booked: bool
+    # Stock left after booking the item
+    remaining_quantity: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class BuyProductsResultSchema(BaseModel):
+    items: List[BuyProductItemResultSchema]
+
+
+class ReleaseProductsSchema(BaseModel):
+    """Gives back the stock booked under the reservation ids. Releasing is
+    idempotent, and a reservation id released before it was booked can't
+    book anything afterwards.
+    """
+    reservation_ids: Annotated[
+        List[Annotated[str, Field(max_length=128)]], Field(min_length=1)
+    ]
+
+
+class ReleaseResultSchema(BaseModel):
+    reservation_id: str
+    released: bool
+    detail: Optional[str] = None
+
+
+class ReleaseProductsResultSchema(BaseModel):
+    items: List[ReleaseResultSchema]
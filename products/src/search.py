@@ -0,0 +1,117 @@
+import logging
+import re
+from typing import List
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from db import Product, ProductStatus
+
+# Full text search over the title and description of the products.
+#
+# Postgres: a GIN index on the tsvector of the product. The index is on an
+# expression of the columns, Postgres keeps it up to date on every write.
+#
+# SQLite: an FTS5 table with the products table as its external content.
+# Triggers keep it up to date on every insert, delete and update of the title
+# or description, so stock updates don't touch it.
+
+PG_DOCUMENT = "to_tsvector('english', title || ' ' || description)"
+
+PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING gin (({PG_DOCUMENT}))",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        title, description, content='products', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF title, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO products_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+# Columns of the search results, the description is not returned
+RESULT_COLUMNS = [
+    Product.id, Product.title, Product.user_id, Product.status,
+    Product.quantity, Product.created_at,
+]
+
+
+def ensure_search_index(engine: sa.Engine):
+    """Creates the search index if it doesn't exist and indexes the existing
+    products. Run at startup, it's a no-op once the index exists.
+    """
+    with engine.begin() as conn:
+        if not sa.inspect(conn).has_table(Product.__tablename__):
+            # A fresh DB, migrations.py creates the index with the tables
+            logging.warning("No products table, the search index is not created")
+            return
+        dialect = conn.dialect.name
+        if dialect == "postgresql":
+            for ddl in PG_DDL:
+                conn.execute(sa.text(ddl))
+        elif dialect == "sqlite":
+            exists = conn.execute(sa.text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"
+            )).first()
+            for ddl in SQLITE_DDL:
+                conn.execute(sa.text(ddl))
+            if not exists:
+                conn.execute(sa.text(
+                    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')"
+                ))
+        else:
+            logging.warning(f"No full text index for {dialect}, the search scans the products")
+
+
+def search_products(session: so.Session, query: str, limit: int, offset: int = 0) -> List[sa.Row]:
+    """Active products matching all the words of the query, best match
+    first.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        document = sa.text(PG_DOCUMENT)
+        tsquery = sa.func.websearch_to_tsquery("english", query)
+        stmt = (
+            sa.select(*RESULT_COLUMNS)
+            .where(document.op("@@")(tsquery))
+            .order_by(sa.func.ts_rank(document, tsquery).desc(), Product.id)
+        )
+    elif dialect == "sqlite":
+        fts = sa.table("products_fts", sa.column("rowid"))
+        # Each word is quoted so that the query can't use the FTS5 syntax,
+        # the last one matches as a prefix for search as you type.
+        match = " ".join(f'"{word}"' for word in words) + "*"
+        stmt = (
+            sa.select(*RESULT_COLUMNS)
+            .join(fts, fts.c.rowid == Product.id)
+            .where(sa.text("products_fts MATCH :match").bindparams(match=match))
+            # bm25 is lower for better matches, a match in the title counts
+            # more than one in the description
+            .order_by(sa.text("bm25(products_fts, 10.0, 1.0)"), Product.id)
+        )
+    else:
+        conditions = [
+            sa.or_(Product.title.ilike(f"%{word}%"), Product.description.ilike(f"%{word}%"))
+            for word in words
+        ]
+        stmt = sa.select(*RESULT_COLUMNS).where(*conditions).order_by(Product.id)
+
+    stmt = stmt.where(Product.status == ProductStatus.ACTIVE)
+    return session.execute(stmt.limit(limit).offset(offset)).all()
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+SERVICE = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(SERVICE / "src"))
+# The package shared by the services, when it's not installed
+sys.path.insert(0, str(SERVICE.parent / "common"))
+
+# Read when the app is imported, before any fixture runs
+os.environ.setdefault("AUTH_JWT_PUBLIC_KEY_FILE", str(SERVICE / "public_key.pem"))
+os.environ.setdefault("AUTH_JWT_PRIVATE_KEY_FILE", str(SERVICE / "private_key.pem"))
+os.environ.setdefault(
+    "PRODUCTS_DB_URL", f"sqlite:///{tempfile.mkdtemp()}/products.db",
+)
@@ -0,0 +1,85 @@
+"""The stock of a hot product is conserved by the reservations and releases,
+also when HOT_SKU_SHARDS changes after the product was sharded"""
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+
+from db import Base, Product, ProductStatus, ProductStockShard
+from hot_inventory import HotSkuInventory
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/products.db")
+    Base.metadata.create_all(engine)
+    with so.Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def product_id(session):
+    product = Product(
+        title="Flash sale", description="", user_id=1,
+        status=ProductStatus.ACTIVE, quantity=10,
+    )
+    session.add(product)
+    session.commit()
+    return product.id
+
+
+def shard_count(session, product_id):
+    return session.scalar(
+        sa.select(sa.func.count()).where(ProductStockShard.product_id == product_id)
+    )
+
+
+def test_reserve_and_release_conserve_the_stock(session, product_id):
+    hot_skus = HotSkuInventory([product_id], shards=4)
+    hot_skus.sync(session)
+
+    reserved = 0
+    for quantity in [3, 2, 4, 1, 5]:
+        if hot_skus.reserve(session, product_id, quantity) is not None:
+            reserved += quantity
+        assert hot_skus.available(session, product_id) + reserved == 10
+    assert reserved == 10
+    assert hot_skus.reserve(session, product_id, 1) is None
+
+    for _ in range(reserved):
+        hot_skus.release(session, product_id, 1)
+    session.commit()
+
+    assert hot_skus.available(session, product_id) == 10
+    assert hot_skus.reconcile(session, product_id)
+    assert session.get(Product, product_id).quantity == 10
+
+
+@pytest.mark.parametrize("old_shards,new_shards", [(4, 8), (8, 4)])
+def test_shard_count_change(session, product_id, old_shards, new_shards):
+    HotSkuInventory([product_id], shards=old_shards).sync(session)
+    assert HotSkuInventory([product_id], shards=old_shards).reserve(session, product_id, 7) == 3
+    session.commit()
+
+    hot_skus = HotSkuInventory([product_id], shards=new_shards)
+    for _ in range(10):
+        hot_skus.release(session, product_id, 1)
+    session.commit()
+    assert hot_skus.available(session, product_id) == 13
+    assert shard_count(session, product_id) == old_shards
+
+    hot_skus.sync(session)
+
+    assert shard_count(session, product_id) == new_shards
+    assert hot_skus.available(session, product_id) == 13
+    assert hot_skus.reserve(session, product_id, 13) == 0
+    assert hot_skus.reserve(session, product_id, 1) is None
+
+
+def test_release_of_a_product_sharded_after_the_startup(session, product_id):
+    hot_skus = HotSkuInventory([product_id], shards=4)
+
+    hot_skus.release(session, product_id, 2)
+    session.commit()
+
+    assert shard_count(session, product_id) == 4
+    assert hot_skus.available(session, product_id) == 12
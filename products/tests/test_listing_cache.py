@@ -0,0 +1,81 @@
+"""The stock changes of the orders service are visible in the cached
+product listing right away"""
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from fastapi.testclient import TestClient
+
+import app as products_app
+from config import AppConfig
+from db import Base
+
+PRIVATE_KEY = serialization.load_pem_private_key(
+    Path(AppConfig().AUTH_JWT_PRIVATE_KEY_FILE).read_bytes(), password=None,
+)
+
+
+def headers(**claims) -> dict:
+    claims["exp"] = datetime.now(timezone.utc) + timedelta(minutes=15)
+    token = jwt.encode(claims, PRIVATE_KEY, algorithm="RS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+SELLER = headers(iss="user_srv", user_id=1, username="seller", user_role="seller")
+# The service token of the orders service
+ORDERS = headers(iss="order_srv")
+
+
+@pytest.fixture(scope="module")
+def client():
+    engine = products_app.engine
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with TestClient(products_app.app) as client:
+        yield client
+
+
+@pytest.fixture
+def product_id(client):
+    response = client.post(
+        "/products", json={"title": "Kettle", "description": "", "quantity": 5}, headers=SELLER,
+    )
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def listed_quantity(client, product_id) -> int:
+    response = client.get("/products", params={"limit": 100}, headers=SELLER)
+    assert response.status_code == 200
+    [product] = [p for p in response.json()["products"] if p["id"] == product_id]
+    return product["quantity"]
+
+
+def test_buy_is_visible_in_the_listing(client, product_id):
+    assert listed_quantity(client, product_id) == 5
+
+    response = client.post(
+        f"/products/{product_id}/buy", params={"order_quantity": 2}, headers=ORDERS,
+    )
+    assert response.status_code == 200
+
+    assert listed_quantity(client, product_id) == 3
+
+
+def test_batch_buy_and_release_are_visible_in_the_listing(client, product_id):
+    assert listed_quantity(client, product_id) == 5
+
+    response = client.post("/products/buy", json={
+        "items": [{"product_id": product_id, "quantity": 2}],
+        "reservation_id": f"order-{product_id}",
+    }, headers=ORDERS)
+    assert response.json()["items"][0]["booked"]
+    assert listed_quantity(client, product_id) == 3
+
+    response = client.post(
+        "/products/release", json={"reservation_ids": [f"order-{product_id}"]}, headers=ORDERS,
+    )
+    assert response.json()["items"][0]["released"]
+    assert listed_quantity(client, product_id) == 5
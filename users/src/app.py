@@ -2,27 +2,34 @@ from functools import lru_cache
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 import uvicorn
-from pathlib import Path
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 import jwt
-from cryptography.hazmat.primitives import serialization
-from cryptography.x509 import load_pem_x509_certificate
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
 from pydantic import BaseModel
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
-from auth import hash_password, verify_password
+from auth import hash_password, verify_password, JWTSigner
 from config import AppConfig
+from ecomm_common.db_pool import create_engine, pool_stats
+from ecomm_common.internal import InternalAuth
+from ecomm_common.jwt_cache import VerifiedTokenCache
+from ecomm_common.keys import load_public_key
+from ecomm_common.metrics import CONTENT_TYPE, Metrics, MetricsMiddleware, instrument_engine
+from ecomm_common.sql_profiler import SqlProfiler, SqlProfilerMiddleware
 from schemas import (
     GetUserSchema, CreateUserSchema, CreateBuyerProfile, CreateSellerProfile,
     GetBuyerProfile,
 )
-from db import BuyerProfile, User, SellerProfile, UserRole
+from user_cache import CachedUser, UserCache
+from db import (
+    BuyerProfile, User, SellerProfile, UserRole,
+)
 
 # to get a string like this run:
 # openssl rand -hex 32
@@ -30,9 +37,15 @@ from db import BuyerProfile, User, SellerProfile, UserRole
 
 conf = AppConfig()
 
-public_key_text = Path(conf.AUTH_JWT_PUBLIC_KEY_FILE).read_text()
-PUBLIC_KEY = load_pem_x509_certificate(public_key_text.encode()).public_key()
-ALGORITHM = "RS256"
+PUBLIC_KEY = load_public_key(conf.AUTH_JWT_PUBLIC_KEY_FILE)
+ALGORITHM = conf.AUTH_JWT_ALGORITHM
+# Parsing the private key is expensive, it is loaded once and reused to sign
+# the tokens on every login.
+jwt_signer = JWTSigner(conf.AUTH_JWT_PRIVATE_KEY_FILE, algorithm=ALGORITHM)
+token_cache = VerifiedTokenCache(conf.AUTH_JWT_CACHE_SIZE)
+user_cache = UserCache(
+    ttl=conf.USERS_CACHE_TTL_SECONDS, maxsize=conf.USERS_CACHE_SIZE,
+)
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 tags_metadata = [
@@ -47,7 +60,11 @@ to regsiter as buyer or seller
     }
 ]
 
-app = FastAPI(openapi_tags=tags_metadata)
+app = FastAPI(openapi_tags=tags_metadata, default_response_class=ORJSONResponse)
+# /internal/* and /metrics, included once their routes are defined
+internal = APIRouter(
+    tags=["Internal"], dependencies=[Depends(InternalAuth(conf.INTERNAL_API_TOKEN))],
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -57,7 +74,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-engine = sa.create_engine(conf.USERS_DB_URL)
+sql_profiler = SqlProfiler(
+    sample_ratio=conf.USERS_DB_PROFILE_SAMPLE_RATIO,
+    slow_query_seconds=conf.USERS_DB_SLOW_QUERY_SECONDS,
+    explain=conf.USERS_DB_EXPLAIN_SLOW_QUERIES,
+)
+app.add_middleware(SqlProfilerMiddleware, profiler=sql_profiler)
+metrics = Metrics()
+# Added last so that it is the outermost middleware and times the others too
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+engine = create_engine(
+    conf.USERS_DB_URL,
+    echo=conf.USERS_DB_ECHO,
+    pool_size=conf.USERS_DB_POOL_SIZE,
+    max_overflow=conf.USERS_DB_MAX_OVERFLOW,
+    pool_pre_ping=conf.USERS_DB_POOL_PRE_PING,
+    pool_recycle=conf.USERS_DB_POOL_RECYCLE,
+)
+Session = so.sessionmaker(bind=engine)
+instrument_engine(engine, metrics)
+sql_profiler.instrument(engine)
+metrics.counter_func(
+    "jwt_cache_requests_total",
+    "Lookups of the verified tokens cache",
+    lambda: {("hits",): token_cache.hits, ("misses",): token_cache.misses},
+    ("result",),
+)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -71,14 +114,20 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: str | None = None
 
+
+class TokenUser(BaseModel):
+    """User details as per the claims of a valid token"""
+    id: int
+    username: str
+    role: UserRole
+
 @lru_cache
 def get_config() -> AppConfig:
     return AppConfig()
 
 
-def get_session(conf: Annotated[AppConfig, Depends(get_config)]):
-    engine = sa.create_engine(conf.USERS_DB_URL, echo=True)
-    s = so.Session(engine)
+def get_session():
+    s = Session()
     try:
         yield s
     finally:
@@ -107,13 +156,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
 
-    private_key_text = Path(conf.AUTH_JWT_PRIVATE_KEY_FILE).read_text()
-    private_key = serialization.load_pem_private_key(
-        private_key_text.encode(),
-        password=None,
-    )
-
-    encoded_jwt = jwt.encode(to_encode, key=private_key, algorithm=ALGORITHM)
+    encoded_jwt = jwt_signer.sign(to_encode)
     return encoded_jwt
 
 
@@ -124,31 +167,70 @@ def get_user(session, username):
     return user
 
 
-async def get_current_user(
-    session: Annotated[so.Session, Depends(get_session)],
-    token: Annotated[str, Depends(oauth2_scheme)],
-) -> User:
-    credentials_exception = HTTPException(
+def verify_token(token: str) -> dict:
+    return jwt.decode(token, key=PUBLIC_KEY, algorithms=[ALGORITHM])
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, key=PUBLIC_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("username")
-        if not username:
-            raise credentials_exception
 
+
+async def get_token_payload(
+    token: Annotated[str, Depends(oauth2_scheme)],
+) -> dict:
+    try:
+        return token_cache.decode(token, verify_token)
     except InvalidTokenError:
-        raise credentials_exception
-    
-    user = get_user(session, username)
-    if user is None:
-        raise credentials_exception
+        raise credentials_exception()
 
+
+async def get_current_user(
+    session: Annotated[so.Session, Depends(get_session)],
+    payload: Annotated[dict, Depends(get_token_payload)],
+) -> CachedUser:
+    username: str = payload.get("username")
+    if not username:
+        raise credentials_exception()
+
+    # Served from the cache for repeat requests of the same user
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+
+    db_user = get_user(session, username)
+    if db_user is None:
+        raise credentials_exception()
+
+    user = CachedUser.from_model(db_user)
+    user_cache.put(user)
     return user
 
 
+async def get_current_identity(
+    session: Annotated[so.Session, Depends(get_session)],
+    payload: Annotated[dict, Depends(get_token_payload)],
+) -> CachedUser | TokenUser:
+    """Used by the endpoints which only need the id, username & role of the
+    user. These are taken from the token if USERS_TRUST_JWT_CLAIMS is set,
+    skipping the lookup of the user.
+    """
+    if not conf.USERS_TRUST_JWT_CLAIMS:
+        return await get_current_user(session, payload)
+
+    try:
+        return TokenUser(
+            id=payload["user_id"],
+            username=payload["username"],
+            role=UserRole(payload["user_role"].upper()),
+        )
+    except (KeyError, AttributeError, ValueError):
+        raise credentials_exception()
+
+
 @app.post("/users/token", tags=['User'])
 async def login_for_access_token(
     session: Annotated[so.Session, Depends(get_session)],
@@ -180,7 +262,7 @@ async def login_for_access_token(
 
 @app.get("/users/me/", response_model=GetUserSchema, tags=['User'])
 async def read_users_me(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[CachedUser, Depends(get_current_user)],
 ):
     return current_user
 
@@ -216,6 +298,7 @@ async def register_user(
     session.add(user)
     session.commit()
     session.refresh(user)
+    user_cache.invalidate(user.username)
 
     return user
 
@@ -223,7 +306,7 @@ async def register_user(
 @app.post("/buyer_profile", response_model=GetBuyerProfile, tags=['User'])
 async def create_buyer_profile(
     session: Annotated[so.Session, Depends(get_session)],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[CachedUser | TokenUser, Depends(get_current_identity)],
     payload: CreateBuyerProfile,
 ):
 
@@ -246,13 +329,14 @@ async def create_buyer_profile(
 
 
     buyer_profile = BuyerProfile(
-        user=current_user,
+        user_id=current_user.id,
         shipping_address=payload.shipping_address,
     )
 
     session.add(buyer_profile)
     session.commit()
     session.refresh(buyer_profile)
+    user_cache.invalidate(current_user.username)
 
     return buyer_profile
 
@@ -260,7 +344,7 @@ async def create_buyer_profile(
 @app.post("/seller_profile", tags=['User'])
 async def create_seller_profile(
     session: Annotated[so.Session, Depends(get_session)],
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[CachedUser | TokenUser, Depends(get_current_identity)],
     payload: CreateSellerProfile,
 ):
     stmt = sa.select(SellerProfile).where(
@@ -281,16 +365,50 @@ async def create_seller_profile(
         )
 
     seller_profile = SellerProfile(
-        user=current_user,
+        user_id=current_user.id,
         store_name=payload.store_name,
     )
 
     session.add(seller_profile)
     session.commit()
     session.refresh(seller_profile)
+    user_cache.invalidate(current_user.username)
 
     return seller_profile
 
 
+@internal.get("/internal/db_pool")
+async def get_db_pool_stats():
+    """Connection pool usage of this process. Used to size the pool against
+    the max_connections of the DB.
+    """
+    return {
+        **pool_stats(engine),
+        "max_size": conf.USERS_DB_POOL_SIZE + conf.USERS_DB_MAX_OVERFLOW,
+    }
+
+
+@internal.get("/internal/jwt_cache")
+async def get_jwt_cache_stats():
+    return token_cache.stats()
+
+
+@internal.get("/internal/sql_profile")
+async def get_sql_profile(limit: Annotated[int, Query(ge=1)] = 20):
+    """The statements which took the most DB time and the queries per
+    route, over the sampled requests
+    """
+    return sql_profiler.report(limit)
+
+
+@internal.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics of this process in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+app.include_router(internal)
+
+
 if __name__ == '__main__':
     uvicorn.run("app:app", host="0.0.0.0", port=8001, reload=True)
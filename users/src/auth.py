@@ -1,4 +1,8 @@
 import hashlib
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.primitives import serialization
 
 def verify_password(given_password: str, hashed_password: str) -> bool:
     given_password_hash = hashlib.sha256(given_password.encode('utf-8')).hexdigest()
@@ -7,3 +11,23 @@ def verify_password(given_password: str, hashed_password: str) -> bool:
 def hash_password(given_password: str) -> str:
     # Use sha256(without a salt)
     return hashlib.sha256(given_password.encode('utf-8')).hexdigest()
+
+
+class JWTSigner:
+    """Signs the access tokens issued by the users service.
+
+    The private key is read and parsed once, logins only pay for the
+    signature. The algorithm has to match the type of the key, eg. RS256
+    for an RSA key, ES256 for a P-256 EC key or EdDSA for an Ed25519 key.
+    """
+
+    def __init__(self, private_key_file: str, algorithm: str = "RS256"):
+        private_key_text = Path(private_key_file).read_text()
+        self._private_key = serialization.load_pem_private_key(
+            private_key_text.encode(),
+            password=None,
+        )
+        self.algorithm = algorithm
+
+    def sign(self, payload: dict) -> str:
+        return jwt.encode(payload, key=self._private_key, algorithm=self.algorithm)
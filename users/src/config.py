@@ -2,6 +2,35 @@ from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
     USERS_DB_URL: str = 'sqlite:///users.db'
+    USERS_DB_ECHO: bool = False
+    # Share of the requests whose queries are aggregated for
+    # /internal/sql_profile. The queries slower than SLOW_QUERY_SECONDS are
+    # logged, with their plan if EXPLAIN_SLOW_QUERIES is set.
+    USERS_DB_PROFILE_SAMPLE_RATIO: float = 0.01
+    USERS_DB_SLOW_QUERY_SECONDS: float = 0.5
+    USERS_DB_EXPLAIN_SLOW_QUERIES: bool = True
+    # Connection pool of the users DB. Size the pool such that
+    # (POOL_SIZE + MAX_OVERFLOW) * workers stays below max_connections of the DB
+    USERS_DB_POOL_SIZE: int = 5
+    USERS_DB_MAX_OVERFLOW: int = 10
+    USERS_DB_POOL_PRE_PING: bool = True
+    # Seconds after which a connection is recycled, -1 to disable
+    USERS_DB_POOL_RECYCLE: int = 1800
     AUTH_JWT_PUBLIC_KEY_FILE: str = 'public_key.pem'
     AUTH_JWT_PRIVATE_KEY_FILE: str = 'private_key.pem'
+    # RS256, ES256 or EdDSA. Has to match the type of the keys and the
+    # algorithm configured in the other services.
+    AUTH_JWT_ALGORITHM: str = 'RS256'
+    # Number of verified tokens cached by the service, 0 to disable the cache
+    AUTH_JWT_CACHE_SIZE: int = 10000
+    # Bearer token of /internal/* and /metrics, they are not served without
+    # one. Give it to the monitoring, eg. the Prometheus scrape config.
+    INTERNAL_API_TOKEN: str | None = None
+    # Users looked up by the authenticated endpoints are cached for TTL
+    # seconds, a size of 0 disables the cache
+    USERS_CACHE_TTL_SECONDS: int = 60
+    USERS_CACHE_SIZE: int = 10000
+    # Trust the user_id, username & user_role claims of a valid token instead
+    # of looking up the user in the endpoints which only need these.
+    USERS_TRUST_JWT_CLAIMS: bool = False
 
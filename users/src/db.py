@@ -44,3 +44,4 @@ class SellerProfile(Base):
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("users.id"), primary_key=True)
     user: so.Mapped["User"] = so.relationship()
     store_name: so.Mapped[str]
+
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from db import User, UserRole
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Snapshot of a User row which can be shared between requests, unlike
+    the ORM object which is bound to the session of a request.
+    """
+    id: int
+    first_name: str
+    last_name: str
+    username: str
+    email: str
+    role: UserRole
+
+    @classmethod
+    def from_model(cls, user: User) -> "CachedUser":
+        return cls(
+            id=user.id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+        )
+
+
+class UserCache:
+    """Per process cache of the users looked up by the authenticated
+    endpoints, keyed by username.
+
+    Entries expire after `ttl` seconds, that's how long another process
+    can serve a stale user. Writes in this process invalidate the entry
+    right away. A `maxsize` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 10_000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[CachedUser, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> CachedUser | None:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[1]:
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return entry[0]
+
+    def put(self, user: CachedUser):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[user.username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)